@@ -0,0 +1,219 @@
+"""Admission control in front of the LLM agent.
+
+``AdmissionController.admit`` runs a request straight away when the global
+and per-session concurrency limits allow, and otherwise parks it in a bounded
+queue ordered by priority (lower runs first). A request is shed with
+``Overloaded`` when the queue is full of work at least as important, when the
+expected wait already exceeds its deadline, or when the deadline passes while
+it waits. The global limit follows AIMD: it grows by one slot per limit's
+worth of successful runs and halves when the upstream answers 429.
+
+Waiting happens on the event loop, so queued requests hold no worker thread;
+only admitted work should be handed to a thread pool. All state is touched
+from the loop alone and needs no lock.
+"""
+import asyncio
+import bisect
+import itertools
+import re
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import telemetry
+
+RATE_LIMIT_ERROR_NAMES = {"ResourceExhausted", "RateLimitError", "TooManyRequests"}
+# Last resort for clients that only put the status in the message. Whole-word
+# "429" and the gRPC status name only: token counts, byte sizes or a
+# "quota_project_id" in an unrelated error must not halve the limit.
+RATE_LIMIT_MESSAGE = re.compile(r"\b429\b|\bresource[ _]exhausted\b", re.IGNORECASE)
+
+
+class Overloaded(Exception):
+    """The request was shed instead of admitted"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request shed: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """True for upstream 429 / quota errors, whichever client raised them"""
+    for candidate in (error, getattr(error, "__cause__", None)):
+        if candidate is None:
+            continue
+        if type(candidate).__name__ in RATE_LIMIT_ERROR_NAMES:
+            return True
+        status = getattr(candidate, "status_code", None) or getattr(candidate, "code", None)
+        status = getattr(getattr(candidate, "response", None), "status_code", status)
+        if status == 429:
+            return True
+    return bool(RATE_LIMIT_MESSAGE.search(str(error)))
+
+
+class _Ticket:
+    __slots__ = ("session_id", "granted", "future")
+
+    def __init__(self, session_id: Optional[str]):
+        self.session_id = session_id
+        self.granted = False
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class AdmissionController:
+    def __init__(self, max_concurrency: int = 8, min_concurrency: int = 1, per_session: int = 1,
+                 queue_size: int = 32, backoff: float = 0.5, cooldown: float = 1.0,
+                 service_estimate: float = 2.0):
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.per_session = per_session
+        self.queue_size = queue_size
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.limit = float(self.max_concurrency)
+        self._in_flight = 0
+        self._sessions = Counter()
+        self._queue = []  # Sorted (priority, sequence, ticket)
+        self._sequence = itertools.count()
+        # EWMA of admitted run time, seeded so a cold start can still shed on expected wait
+        self._service_seconds = service_estimate
+        self._last_backoff = 0.0
+        telemetry.ADMISSION_LIMIT.set(self.limit)
+
+    @asynccontextmanager
+    async def admit(self, session_id: Optional[str] = None, priority: int = 1,
+                    deadline: Optional[float] = None):
+        """Hold a slot for the duration of the block, or raise ``Overloaded``.
+
+        ``deadline`` is a ``time.monotonic()`` instant, normally the request's
+        arrival plus its queueing budget.
+        """
+        with telemetry.span("admission", priority=priority) as active:
+            waited = time.perf_counter()
+            try:
+                await self._acquire(session_id, priority, deadline)
+            except Overloaded as e:
+                active.set(shed=e.reason)
+                telemetry.ADMISSION_SHED.labels(e.reason, str(priority)).inc()
+                raise
+            finally:
+                telemetry.ADMISSION_WAIT.labels(str(priority)).observe(time.perf_counter() - waited)
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            if is_rate_limit_error(e):
+                self.record_rate_limit()
+            raise
+        else:
+            self.record_success()
+        finally:
+            self._release(session_id, time.perf_counter() - started)
+
+    async def _acquire(self, session_id: Optional[str], priority: int, deadline: Optional[float]):
+        remaining = float("inf") if deadline is None else deadline - time.monotonic()
+        # Anyone still queued is waiting on a full limit or their own session
+        if self._has_room(session_id):
+            self._start(session_id)
+            return
+        if remaining <= 0 or self._expected_wait(priority) > remaining:
+            raise Overloaded("deadline", self._retry_after(priority))
+        if len(self._queue) >= self.queue_size:
+            worst = self._queue[-1]
+            if worst[0] <= priority:
+                raise Overloaded("queue_full", self._retry_after(priority))
+            # Make room by shedding the least important waiter instead
+            self._queue.pop()
+            worst[2].future.set_exception(Overloaded("displaced", self._retry_after(worst[0])))
+        ticket = _Ticket(session_id)
+        bisect.insort(self._queue, (priority, next(self._sequence), ticket))
+        telemetry.ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), None if deadline is None else remaining)
+        except asyncio.TimeoutError:
+            if ticket.granted:
+                return
+            self._remove(ticket)
+            raise Overloaded("deadline", self._retry_after(priority)) from None
+        except asyncio.CancelledError:
+            # The client went away; give back a slot handed over in the meantime
+            if ticket.granted:
+                self._release(session_id, None)
+            else:
+                self._remove(ticket)
+            raise
+
+    def _remove(self, ticket: _Ticket):
+        self._queue = [entry for entry in self._queue if entry[2] is not ticket]
+        telemetry.ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+        if not ticket.future.done():
+            ticket.future.cancel()
+
+    def _has_room(self, session_id: Optional[str]) -> bool:
+        if self._in_flight >= int(self.limit):
+            return False
+        return session_id is None or self.per_session <= 0 or self._sessions[session_id] < self.per_session
+
+    def _start(self, session_id: Optional[str]):
+        self._in_flight += 1
+        if session_id is not None:
+            self._sessions[session_id] += 1
+
+    def _release(self, session_id: Optional[str], seconds: Optional[float]):
+        self._in_flight -= 1
+        if session_id is not None:
+            self._sessions[session_id] -= 1
+            if self._sessions[session_id] <= 0:
+                del self._sessions[session_id]
+        if seconds is not None:
+            self._service_seconds = 0.8 * self._service_seconds + 0.2 * seconds
+        self._dispatch()
+
+    def _dispatch(self):
+        """Hand free slots to waiters in priority order, skipping sessions at their limit"""
+        granted = False
+        for _, _, ticket in self._queue:
+            if self._in_flight >= int(self.limit):
+                break
+            if self._has_room(ticket.session_id):
+                self._start(ticket.session_id)
+                ticket.granted = True
+                ticket.future.set_result(None)
+                granted = True
+        if granted:
+            self._queue = [entry for entry in self._queue if not entry[2].granted]
+            telemetry.ADMISSION_QUEUE_DEPTH.set(len(self._queue))
+
+    def _expected_wait(self, priority: int) -> float:
+        ahead = sum(1 for entry in self._queue if entry[0] <= priority)
+        return (ahead + 1) / max(1, int(self.limit)) * self._service_seconds
+
+    def _retry_after(self, priority: int) -> float:
+        return max(1.0, round(self._expected_wait(priority), 1))
+
+    def record_success(self):
+        if self.limit < self.max_concurrency:
+            self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            telemetry.ADMISSION_LIMIT.set(self.limit)
+            self._dispatch()
+
+    def record_rate_limit(self):
+        telemetry.UPSTREAM_RATE_LIMITED.inc()
+        now = time.monotonic()
+        # Requests already in flight report the same overload; back off once per window
+        if now - self._last_backoff < self.cooldown:
+            return
+        self._last_backoff = now
+        self.limit = max(self.min_concurrency, self.limit * self.backoff)
+        telemetry.ADMISSION_LIMIT.set(self.limit)
+
+    def status(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self._in_flight,
+            "queued": len(self._queue),
+            "service_seconds": round(self._service_seconds, 3),
+        }
@@ -0,0 +1,76 @@
+"""Factories for the external services the chatbot talks to.
+
+``chatbot.py`` builds its LLM, embeddings, web search, page fetcher, TTS
+backend and shared state store through these functions. Call ``configure`` before importing the
+chatbot to swap any of them out, e.g. for the offline benchmark fakes.
+"""
+import os
+
+import requests
+
+_overrides = {}
+
+
+def configure(**overrides):
+    """Override backends by name: llm, embeddings, search, fetch, tts, state"""
+    unknown = set(overrides) - {'llm', 'embeddings', 'search', 'fetch', 'tts', 'state'}
+    if unknown:
+        raise ValueError(f"Unknown backends: {', '.join(sorted(unknown))}")
+    _overrides.update(overrides)
+
+
+def create_llm():
+    if 'llm' in _overrides:
+        return _overrides['llm']
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    # The client's own retries back off for up to a minute while holding an admission
+    # slot, hiding 429s from the AIMD limit. langchain_google_genai counts attempts
+    # here, so the default of 1 sends each request once and lets admission back off.
+    return ChatGoogleGenerativeAI(
+        model="gemini-1.5-flash",
+        temperature=0.7,
+        max_retries=int(os.environ.get("LLM_MAX_RETRIES", 1)),
+    )
+
+
+def create_embeddings():
+    if 'embeddings' in _overrides:
+        return _overrides['embeddings']
+    if os.environ.get("EMBEDDINGS_BACKEND", "google") == "sentence-transformers":
+        # Local CPU model; batching concurrent queries matters most here
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(
+            model_name=os.environ.get("EMBEDDINGS_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"),
+            encode_kwargs={"batch_size": int(os.environ.get("EMBED_BATCH_MAX_SIZE", 32)), "normalize_embeddings": True},
+        )
+    from langchain_google_genai import GoogleGenerativeAIEmbeddings
+    return GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+
+
+def create_tts_backend():
+    if 'tts' in _overrides:
+        return _overrides['tts']
+    from tts_pipeline import create_tts_backend as create_named_backend
+    return create_named_backend(os.environ.get("TTS_BACKEND", "gtts"))
+
+
+def create_state_store():
+    if 'state' in _overrides:
+        return _overrides['state']
+    from state_store import create_state_store as create_store_from_url
+    return create_store_from_url(os.environ.get("STATE_STORE_URL", "memory://"))
+
+
+def web_search(query: str) -> str:
+    if 'search' in _overrides:
+        return _overrides['search'](query)
+    from langchain_community.tools import DuckDuckGoSearchRun
+    return DuckDuckGoSearchRun().run(query)
+
+
+def fetch_page(url: str, headers: dict, timeout: float) -> bytes:
+    if 'fetch' in _overrides:
+        return _overrides['fetch'](url)
+    response = requests.get(url, headers=headers, timeout=timeout)
+    response.raise_for_status()
+    return response.content
@@ -0,0 +1,229 @@
+"""Offline stand-ins for the LLM, embeddings, search, scraper and TTS backends.
+
+Every fake sleeps for a latency drawn from a ``LatencyModel`` and fails with
+its configured probability, and records how long each call took in a shared
+``StageRecorder`` so the load test can report per-stage latency.
+"""
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, FunctionMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+
+class FakeUpstreamError(RuntimeError):
+    """Raised by a fake backend to simulate an upstream failure"""
+
+
+class FakeRateLimitError(FakeUpstreamError):
+    """Simulated HTTP 429 from an upstream that is over capacity"""
+
+    status_code = 429
+
+
+class LatencyModel:
+    """Log-normal latency with a median and p95, plus a failure probability.
+
+    With ``capacity`` set, calls beyond that many in flight fail at once with
+    ``FakeRateLimitError``, like a rate-limited API.
+    """
+
+    def __init__(self, median_ms: float, p95_ms: Optional[float] = None, failure_rate: float = 0.0,
+                 seed: Optional[int] = None, capacity: Optional[int] = None):
+        self.median_ms = median_ms
+        self.p95_ms = p95_ms if p95_ms is not None else median_ms * 2
+        self.failure_rate = failure_rate
+        self.capacity = capacity
+        self._in_flight = 0
+        # p95 of a log-normal sits 1.645 sigma above the median in log space
+        self.sigma = math.log(max(self.p95_ms, median_ms) / median_ms) / 1.645 if median_ms > 0 else 0.0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        """Return a latency in seconds, or raise to simulate a failure"""
+        with self._lock:
+            failed = self._random.random() < self.failure_rate
+            latency = self.median_ms * math.exp(self._random.gauss(0, self.sigma)) if self.median_ms > 0 else 0.0
+        if failed:
+            raise FakeUpstreamError("Simulated upstream failure")
+        return latency / 1000
+
+    @contextmanager
+    def occupy(self):
+        """Hold one unit of upstream capacity for the duration of a call"""
+        with self._lock:
+            if self.capacity and self._in_flight >= self.capacity:
+                raise FakeRateLimitError("429 Resource has been exhausted (simulated)")
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+
+class StageRecorder:
+    """Thread-safe collection of per-stage call durations"""
+
+    def __init__(self):
+        self._durations = defaultdict(list)
+        self._errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def run(self, stage: str, latency: LatencyModel) -> None:
+        started = time.perf_counter()
+        try:
+            with latency.occupy():
+                time.sleep(latency.sample())
+        except FakeUpstreamError:
+            with self._lock:
+                self._errors[stage] += 1
+            raise
+        finally:
+            with self._lock:
+                self._durations[stage].append(time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'durations': {stage: list(values) for stage, values in self._durations.items()},
+                'errors': dict(self._errors),
+            }
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._errors.clear()
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+URL_PATTERN = re.compile(r"https?://[^\s)>\"']+")
+PRICING_PATTERN = re.compile(r"\b(?:price|prices|pricing|cost|how much)\b|दाम|कीमत|किंमत|দাম", re.IGNORECASE)
+
+
+def choose_tool(question: str) -> tuple:
+    """Pick the tool a real model would: scrape a URL, search the web for prices, else NABARD"""
+    url = URL_PATTERN.search(question)
+    if url:
+        return 'web_scraper', url.group(0)
+    if PRICING_PATTERN.search(question):
+        return 'web_search', question
+    return 'nabard_rag_search', question
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that calls one tool chosen by ``choose_tool``, then answers"""
+
+    latency: Any
+    recorder: Any
+    reply_words: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-latency-chat"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        self.recorder.run('llm', self.latency)
+        prompt_text = "\n".join(str(message.content) for message in messages)
+        question = next(
+            (str(message.content) for message in reversed(messages) if isinstance(message, HumanMessage)), ""
+        )
+        used_tool = any(isinstance(message, (FunctionMessage, ToolMessage)) for message in messages)
+
+        if kwargs.get('functions') and not used_tool:
+            tool, argument = choose_tool(question)
+            message = AIMessage(
+                content="",
+                additional_kwargs={
+                    'function_call': {
+                        'name': tool,
+                        'arguments': json.dumps({'__arg1': argument}),
+                    }
+                },
+            )
+        else:
+            words = (question.split() or ["carbon"]) * self.reply_words
+            message = AIMessage(content=f"Here is what I found. {' '.join(words[:self.reply_words])}.")
+
+        input_tokens = _estimate_tokens(prompt_text)
+        output_tokens = _estimate_tokens(str(message.content) or json.dumps(message.additional_kwargs))
+        message.usage_metadata = {
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'total_tokens': input_tokens + output_tokens,
+        }
+        return ChatResult(
+            generations=[ChatGeneration(message=message)],
+            llm_output={'token_usage': dict(message.usage_metadata)},
+        )
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic hash-seeded vectors; one latency sample per call"""
+
+    def __init__(self, latency: LatencyModel, recorder: StageRecorder, size: int = 64):
+        self.latency = latency
+        self.recorder = recorder
+        self.size = size
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        generator = random.Random(seed)
+        vector = [generator.gauss(0, 1) for _ in range(self.size)]
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.recorder.run('embedding', self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.recorder.run('embedding', self.latency)
+        return self._vector(text)
+
+
+class FakeSearch:
+    def __init__(self, latency: LatencyModel, recorder: StageRecorder):
+        self.latency = latency
+        self.recorder = recorder
+
+    def __call__(self, query: str) -> str:
+        self.recorder.run('search', self.latency)
+        return " ".join(f"Result {rank}: {query} - carbon credit prices and schemes." for rank in range(1, 6))
+
+
+class FakeFetch:
+    def __init__(self, latency: LatencyModel, recorder: StageRecorder):
+        self.latency = latency
+        self.recorder = recorder
+
+    def __call__(self, url: str) -> bytes:
+        self.recorder.run('scrape', self.latency)
+        paragraphs = "".join(f"<p>Paragraph {index} about agroforestry carbon credits at {url}.</p>" for index in range(40))
+        return f"<html><body><main>{paragraphs}</main></body></html>".encode("utf-8")
+
+
+class FakeTTSBackend:
+    """Returns roughly 1 KB of MP3-like bytes per 10 characters of text"""
+
+    def __init__(self, latency: LatencyModel, recorder: StageRecorder):
+        self.latency = latency
+        self.recorder = recorder
+
+    def synthesize(self, text: str, lang: str, slow: bool = False) -> bytes:
+        self.recorder.run('tts', self.latency)
+        return b"\xff\xfb" + bytes(max(1, len(text) // 10) * 1024)
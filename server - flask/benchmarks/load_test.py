@@ -0,0 +1,396 @@
+"""Offline load test for the chatbot service.
+
+Boots the FastAPI ``app`` from ``chatbot.py`` on a local port with fake LLM,
+embedding, search, scraper and TTS backends, then drives a multilingual mix
+of ``/chat`` and ``/speak`` requests at fixed concurrency levels.
+
+Run from the ``server - flask`` directory::
+
+    python -m benchmarks.load_test --concurrency 1 8 32 --requests 200
+    python -m benchmarks.load_test --output bench.json
+    python -m benchmarks.load_test --baseline bench.json --tolerance 0.15
+    python -m benchmarks.load_test --state-store redis --sessions 16
+
+With ``--baseline`` the run exits non-zero when p95 latency or throughput
+regresses by more than the tolerance at any endpoint and concurrency level.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import resource
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fakes import (
+    FakeChatModel,
+    FakeEmbeddings,
+    FakeFetch,
+    FakeSearch,
+    FakeTTSBackend,
+    LatencyModel,
+    StageRecorder,
+)
+
+CHAT_QUERIES = [
+    ('en', "What is this platform and how can farmers earn from it?"),
+    ('en', "How much can I earn per tonne of carbon credits from agroforestry?"),
+    ('en', "AWD"),
+    ('en', "Which NABARD schemes support FPO financing?"),
+    ('en', "Summarise https://www.nabard.org/content1.aspx?id=23 for me"),
+    ('hi', "धान की खेती में मीथेन कैसे कम करें?"),
+    ('hi', "नाबार्ड की कौन सी योजनाएं कृषि वानिकी के लिए हैं?"),
+    ('bn', "কার্বন ক্রেডিটের দাম কত?"),
+    ('ta', "வேளாண் காடு வளர்ப்பு மூலம் எவ்வளவு சம்பாதிக்கலாம்?"),
+    ('te', "వరి సాగులో AWD పద్ధతి ఏమిటి?"),
+    ('mr', "कार्बन क्रेडिट म्हणजे काय?"),
+]
+
+SPEAK_MESSAGES = [
+    ('en', "Hello! I am CarbonBot. How can I help you today?"),
+    ('en', "Agroforestry credits usually trade between eight and twenty five dollars per tonne. "
+           "Prices depend on the project type and certification. Check recent market data before selling."),
+    ('hi', "नमस्ते! मैं कार्बनबॉट हूँ। आज मैं आपकी क्या मदद कर सकता हूँ?"),
+    ('hi', "वैकल्पिक गीला और सूखा तरीका मीथेन को तीस से पचास प्रतिशत तक कम करता है। "
+           "इससे पानी की भी बचत होती है। नाबार्ड इसके लिए सहायता देता है।"),
+    ('bn', "কার্বন ক্রেডিট বিক্রি করে কৃষকরা অতিরিক্ত আয় করতে পারেন। আরও জানতে আমাকে জিজ্ঞাসা করুন।"),
+    ('ta', "வணக்கம்! உங்களுக்கு எப்படி உதவலாம்?"),
+]
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(values):
+    values_ms = [value * 1000 for value in values]
+    return {
+        'count': len(values_ms),
+        'p50_ms': percentile(values_ms, 0.50),
+        'p95_ms': percentile(values_ms, 0.95),
+        'p99_ms': percentile(values_ms, 0.99),
+        'mean_ms': statistics.fmean(values_ms) if values_ms else None,
+    }
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def build_backends(args, recorder):
+    def latency(prefix):
+        return LatencyModel(
+            getattr(args, f"{prefix}_ms"),
+            getattr(args, f"{prefix}_p95_ms"),
+            getattr(args, f"{prefix}_failure_rate"),
+            seed=args.seed,
+            capacity=getattr(args, f"{prefix}_capacity", None),
+        )
+
+    return {
+        'llm': FakeChatModel(latency=latency('llm'), recorder=recorder),
+        'embeddings': FakeEmbeddings(latency('embedding'), recorder),
+        'search': FakeSearch(latency('search'), recorder),
+        'fetch': FakeFetch(latency('scrape'), recorder),
+        'tts': FakeTTSBackend(latency('tts'), recorder),
+    }
+
+
+def start_server(app, port):
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="bench-server", daemon=True)
+    thread.start()
+    deadline = time.monotonic() + 30
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("Benchmark server did not start")
+        time.sleep(0.05)
+    return server, thread
+
+
+def wait_until_ready(port, timeout=120):
+    """Poll ``/ready`` until warmup finishes"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        try:
+            connection.request("GET", "/ready")
+            response = connection.getresponse()
+            body = json.loads(response.read() or b"{}")
+            if response.status == 200:
+                return
+            # Failed attempts are retried; only give up once the server does
+            if body.get("data", {}).get("failed"):
+                raise RuntimeError(f"Warmup failed: {body['data']['error']}")
+        except OSError:
+            pass
+        finally:
+            connection.close()
+        time.sleep(0.05)
+    raise RuntimeError("Benchmark server did not become ready")
+
+
+def send(port, path, payload):
+    """POST a JSON body; returns (seconds to first byte, total seconds, ok, shed)"""
+    body = json.dumps(payload).encode("utf-8")
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    started = time.perf_counter()
+    try:
+        connection.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+        response = connection.getresponse()
+        first = response.read(1)
+        first_byte = time.perf_counter() - started
+        rest = response.read()
+        total = time.perf_counter() - started
+        ok = response.status < 400 and bool(first or rest)
+        shed = False
+        if ok and path == "/chat":
+            data = json.loads(first + rest).get("data", {})
+            ok = not data.get("error", False)
+            shed = bool(data.get("busy", False))
+        return first_byte, total, ok, shed
+    finally:
+        connection.close()
+
+
+def run_level(port, endpoint, concurrency, total_requests, rng, sessions=8):
+    if endpoint == "chat":
+        workload = [{"message": message, "language": language} for language, message in CHAT_QUERIES]
+    else:
+        workload = [{"message": message, "language": language} for language, message in SPEAK_MESSAGES]
+    payloads = [dict(rng.choice(workload)) for _ in range(total_requests)]
+    if endpoint == "chat":
+        # Multi-turn traffic: each request continues one of a few conversations
+        for payload in payloads:
+            payload["session_id"] = f"bench-{rng.randrange(sessions)}"
+
+    results = []
+    started_at = time.time()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for result in pool.map(lambda payload: send(port, f"/{endpoint}", payload), payloads):
+            results.append(result)
+    elapsed = time.perf_counter() - started
+
+    successes = [result for result in results if result[2]]
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': total_requests,
+        'errors': total_requests - len(successes),
+        # Busy replies are admission control shedding load, also counted in errors
+        'shed': sum(1 for result in results if result[3]),
+        'throughput_rps': len(successes) / elapsed if elapsed else None,
+        'latency': summarize([result[1] for result in successes]),
+        'time_to_first_byte': summarize([result[0] for result in successes]),
+        'window': (started_at, time.time()),
+    }
+
+
+def first_llm_call_delays(trace_file, since):
+    """``(arrival, seconds to the first LLM call)`` for each traced /chat request.
+
+    /chat replies are not streamed, so time to first byte is the whole
+    request; the first ``llm`` span shows how long queueing, admission and
+    prompt assembly kept the model waiting.
+    """
+    arrivals, first_llm = {}, {}
+    try:
+        with open(trace_file, encoding="utf-8") as handle:
+            spans = [json.loads(line) for line in handle if line.strip()]
+    except OSError:
+        return []
+    for span in spans:
+        if span["start_time"] < since:
+            continue
+        if span["name"] == "request" and span["attributes"].get("endpoint") == "/chat":
+            arrivals[span["trace_id"]] = span["start_time"]
+        elif span["name"] == "llm":
+            first_llm[span["trace_id"]] = min(first_llm.get(span["trace_id"], span["start_time"]), span["start_time"])
+    return [(arrival, first_llm[trace_id] - arrival) for trace_id, arrival in arrivals.items() if trace_id in first_llm]
+
+
+def compare(results, baseline, tolerance):
+    """Return human-readable regressions against a previous run"""
+    previous = {(level['endpoint'], level['concurrency']): level for level in baseline.get('levels', [])}
+    regressions = []
+    for level in results['levels']:
+        old = previous.get((level['endpoint'], level['concurrency']))
+        if not old:
+            continue
+        label = f"/{level['endpoint']} @ c={level['concurrency']}"
+        old_p95, new_p95 = old['latency']['p95_ms'], level['latency']['p95_ms']
+        if old_p95 and new_p95 and new_p95 > old_p95 * (1 + tolerance):
+            regressions.append(f"{label}: p95 {old_p95:.1f} ms -> {new_p95:.1f} ms")
+        old_rps, new_rps = old['throughput_rps'], level['throughput_rps']
+        if old_rps and new_rps is not None and new_rps < old_rps * (1 - tolerance):
+            regressions.append(f"{label}: throughput {old_rps:.1f} -> {new_rps:.1f} req/s")
+    return regressions
+
+
+def print_report(results):
+    print(f"\n{'endpoint':<8} {'conc':>5} {'rps':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'ttfb50':>9} {'ttfb95':>9} "
+          f"{'llm1st50':>9} {'llm1st95':>9} {'err':>5} {'shed':>5}")
+    for level in results['levels']:
+        latency, ttfb = level['latency'], level['time_to_first_byte']
+        first_llm = level.get('time_to_first_llm_call') or {}
+
+        def ms(value):
+            return f"{value:.1f}" if value is not None else "-"
+
+        print(
+            f"/{level['endpoint']:<7} {level['concurrency']:>5} {ms(level['throughput_rps']):>8} "
+            f"{ms(latency['p50_ms']):>9} {ms(latency['p95_ms']):>9} {ms(latency['p99_ms']):>9} "
+            f"{ms(ttfb['p50_ms']):>9} {ms(ttfb['p95_ms']):>9} "
+            f"{ms(first_llm.get('p50_ms')):>9} {ms(first_llm.get('p95_ms')):>9} {level['errors']:>5} {level.get('shed', 0):>5}"
+        )
+    print("\nPer-stage latency (fake upstream calls):")
+    for stage, summary in sorted(results['stages'].items()):
+        print(
+            f"  {stage:<10} n={summary['count']:<6} p50={summary['p50_ms']:.1f} ms "
+            f"p95={summary['p95_ms']:.1f} ms p99={summary['p99_ms']:.1f} ms errors={summary['errors']}"
+        )
+    print(f"\nStartup: listening after {results['startup_seconds']:.2f} s, ready after {results['ready_seconds']:.2f} s")
+    print(f"RSS: {results['rss_mb']['current']:.1f} MB current, {results['rss_mb']['peak']:.1f} MB peak")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", default=["chat", "speak"], choices=["chat", "speak"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Compare against a previous --output file")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--state-store", default="memory", choices=["memory", "sqlite", "redis"],
+                        help="Session store; redis runs against the local RESP stand-in")
+    parser.add_argument("--sessions", type=int, default=8, help="Distinct chat sessions in the workload")
+    for stage, median, failure in (('llm', 400, 0.0), ('embedding', 60, 0.0), ('search', 300, 0.0),
+                                   ('scrape', 250, 0.0), ('tts', 150, 0.0)):
+        parser.add_argument(f"--{stage}-ms", type=float, default=median, help=f"Median {stage} latency")
+        parser.add_argument(f"--{stage}-p95-ms", type=float, default=None, help=f"p95 {stage} latency")
+        parser.add_argument(f"--{stage}-failure-rate", type=float, default=failure)
+    parser.add_argument("--llm-capacity", type=int, default=None,
+                        help="Concurrent LLM calls before the fake upstream answers 429")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    recorder = StageRecorder()
+
+    # Keep the run hermetic: no hot-reload thread and a throwaway TTS cache
+    os.environ.setdefault("KB_RELOAD_INTERVAL", "0")
+    os.environ.setdefault("TTS_CACHE_DIR", tempfile.mkdtemp(prefix="bench_tts_"))
+    os.environ.setdefault("INDEX_DIR", tempfile.mkdtemp(prefix="bench_index_"))
+    if args.state_store == "sqlite":
+        os.environ["STATE_STORE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='bench_state_')}/state.db"
+    elif args.state_store == "redis":
+        from benchmarks.resp_server import RESPServer
+        resp_server = RESPServer(port=0)
+        resp_server.start()
+        os.environ["STATE_STORE_URL"] = f"redis://127.0.0.1:{resp_server.server_address[1]}/0"
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Spans give the time each /chat request waited for its first LLM call
+    trace_file = os.environ.setdefault("TRACE_FILE", os.path.join(tempfile.mkdtemp(prefix="bench_traces_"), "traces.jsonl"))
+    run_started_at = time.time()
+
+    import backends
+    backends.configure(**build_backends(args, recorder))
+    started = time.perf_counter()
+    import chatbot
+
+    port = free_port()
+    server, thread = start_server(chatbot.app, port)
+    # Listening happens before warmup; ready is when requests can be served
+    startup_seconds = time.perf_counter() - started
+    wait_until_ready(port)
+    ready_seconds = time.perf_counter() - started
+    rng = random.Random(args.seed)
+    recorder.reset()
+
+    levels = []
+    try:
+        for endpoint in args.endpoints:
+            for concurrency in args.concurrency:
+                level = run_level(port, endpoint, concurrency, args.requests, rng, args.sessions)
+                level['rss_mb'] = current_rss_mb()
+                levels.append(level)
+                print(f"/{endpoint} c={concurrency}: {level['throughput_rps']:.1f} req/s, "
+                      f"p95 {level['latency']['p95_ms'] or 0:.1f} ms", file=sys.stderr)
+    finally:
+        server.should_exit = True
+        thread.join(timeout=10)
+
+    # Let the span exporter flush its last batch
+    time.sleep(1.5)
+    delays = first_llm_call_delays(trace_file, run_started_at)
+    for level in levels:
+        window_start, window_end = level.pop('window')
+        if level['endpoint'] == 'chat':
+            level['time_to_first_llm_call'] = summarize(
+                [delay for arrival, delay in delays if window_start <= arrival <= window_end])
+
+    stage_data = recorder.snapshot()
+    results = {
+        'startup_seconds': startup_seconds,
+        'ready_seconds': ready_seconds,
+        'state_store': args.state_store,
+        'levels': levels,
+        'stages': {
+            stage: {**summarize(durations), 'errors': stage_data['errors'].get(stage, 0)}
+            for stage, durations in stage_data['durations'].items()
+        },
+        'rss_mb': {'current': current_rss_mb() or 0.0, 'peak': peak_rss_mb()},
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+    }
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            regressions = compare(results, json.load(handle), args.tolerance)
+        if regressions:
+            print("\nPerformance regressions:", *regressions, sep="\n  ")
+            return 1
+        print("\nNo regressions against baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""Local stand-in for Redis, enough for ``RedisStateStore``.
+
+Implements PING, AUTH, SELECT, GET, MGET, SET (with EX/PX), RPUSH, LRANGE,
+LTRIM, PEXPIRE, DEL, DBSIZE, FLUSHALL and QUIT over RESP2, with lazy TTL expiry. It lets several chatbot workers
+share sessions on a laptop or in CI without installing Redis:
+
+    python -m benchmarks.resp_server --port 6380
+    STATE_STORE_URL=redis://127.0.0.1:6380/0 uvicorn chatbot:app --workers 4
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class _Store:
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self.data[key]
+            return None
+        return value
+
+    def set(self, key, value, expires_at=None):
+        self.data[key] = (value, expires_at)
+
+
+def _list_range(items, start, stop):
+    """Redis index semantics: inclusive, negative counts from the end"""
+    length = len(items)
+    start = max(start + length if start < 0 else start, 0)
+    stop = min(stop + length if stop < 0 else stop, length - 1)
+    return items[start:stop + 1] if start <= stop else []
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    WRONGTYPE = b"-WRONGTYPE Operation against a key holding the wrong kind of value\r\n"
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.split()  # Inline command, e.g. from telnet
+        arguments = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            arguments.append(self.rfile.read(length + 2)[:-2])
+        return arguments
+
+    @staticmethod
+    def _bulk(value):
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            command = self._read_command()
+            if command is None:
+                return
+            if not command:
+                continue
+            name, arguments = command[0].upper(), command[1:]
+            if name == b"QUIT":
+                self.wfile.write(b"+OK\r\n")
+                return
+            with store.lock:
+                reply = self._dispatch(store, name, arguments)
+            self.wfile.write(reply)
+
+    def _dispatch(self, store, name, arguments):
+        if name == b"PING":
+            return b"+PONG\r\n"
+        if name in (b"AUTH", b"SELECT"):
+            return b"+OK\r\n"
+        if name == b"GET" and len(arguments) == 1:
+            value = store.get(arguments[0])
+            if isinstance(value, list):
+                return self.WRONGTYPE
+            return self._bulk(value)
+        if name == b"MGET" and arguments:
+            values = [store.get(key) for key in arguments]
+            return b"*%d\r\n" % len(values) + b"".join(
+                self._bulk(None if isinstance(value, list) else value) for value in values)
+        if name in (b"RPUSH", b"LRANGE", b"LTRIM") and arguments:
+            return self._dispatch_list(store, name, arguments)
+        if name == b"PEXPIRE" and len(arguments) == 2:
+            value = store.get(arguments[0])
+            if value is None:
+                return b":0\r\n"
+            store.set(arguments[0], value, time.time() + int(arguments[1]) / 1000)
+            return b":1\r\n"
+        if name == b"SET" and len(arguments) in (2, 4):
+            expires_at = None
+            if len(arguments) == 4:
+                unit = arguments[2].upper()
+                if unit not in (b"EX", b"PX"):
+                    return b"-ERR syntax error\r\n"
+                expires_at = time.time() + int(arguments[3]) / (1 if unit == b"EX" else 1000)
+            store.set(arguments[0], arguments[1], expires_at)
+            return b"+OK\r\n"
+        if name == b"DEL" and arguments:
+            return b":%d\r\n" % sum(store.data.pop(key, None) is not None for key in arguments)
+        if name == b"DBSIZE":
+            return b":%d\r\n" % len(store.data)
+        if name == b"FLUSHALL":
+            store.data.clear()
+            return b"+OK\r\n"
+        return b"-ERR unknown command or wrong number of arguments\r\n"
+
+    def _dispatch_list(self, store, name, arguments):
+        key = arguments[0]
+        items = store.get(key)
+        if items is not None and not isinstance(items, list):
+            return self.WRONGTYPE
+        items = items or []
+        if name == b"RPUSH" and len(arguments) >= 2:
+            expires_at = store.data[key][1] if key in store.data else None
+            items = items + list(arguments[1:])
+            store.set(key, items, expires_at)
+            return b":%d\r\n" % len(items)
+        if len(arguments) != 3:
+            return b"-ERR wrong number of arguments\r\n"
+        selected = _list_range(items, int(arguments[1]), int(arguments[2]))
+        if name == b"LRANGE":
+            return b"*%d\r\n" % len(selected) + b"".join(self._bulk(item) for item in selected)
+        if selected:
+            store.set(key, selected, store.data[key][1])
+        else:
+            store.data.pop(key, None)
+        return b"+OK\r\n"
+
+
+class RESPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6380):
+        super().__init__((host, port), _Handler)
+        self.store = _Store()
+
+    def start(self) -> threading.Thread:
+        """Serve on a daemon thread, for use inside the load test"""
+        thread = threading.Thread(target=self.serve_forever, name="resp-server", daemon=True)
+        thread.start()
+        return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6380)
+    args = parser.parse_args(argv)
+    with RESPServer(args.host, args.port) as server:
+        print(f"RESP stand-in listening on {args.host}:{args.port}")
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -132,13 +132,18 @@
 #         print(f"TTS Error: {e}")
 #         return {"audio_base64": ""}
 
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from gtts import gTTS
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 from io import BytesIO
-import requests
+from itertools import chain
+import hmac
+import logging
+import os
+import threading
 from bs4 import BeautifulSoup
 import re
 import time
@@ -152,16 +157,24 @@ except ImportError:
     LANGDETECT_AVAILABLE = False
     print("Warning: langdetect not installed. Language detection disabled. Install with: pip install langdetect")
 
-from langchain_google_genai import ChatGoogleGenerativeAI, GoogleGenerativeAIEmbeddings
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_community.vectorstores import Chroma
 from langchain_core.tools import Tool
 from langchain.agents import create_openai_functions_agent, AgentExecutor
-from langchain.memory import ConversationBufferMemory
+from langchain_core.messages import AIMessage, HumanMessage, messages_from_dict, messages_to_dict
 from dotenv import load_dotenv
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import TextLoader
-from langchain_community.tools import DuckDuckGoSearchRun
+
+import backends
+import telemetry
+from admission import AdmissionController, Overloaded, is_rate_limit_error
+from caching import LRUCache, normalize_query
+from context_budget import ContextAssembler, RequestBudget, parse_shares
+from embedding_batcher import EmbeddingBatcher
+from ingestion import KnowledgeBase
+from retrieval import HybridRetriever
+from state_store import STORE_ERRORS, InMemoryStateStore, SharedCache
+from tts_cache import TTSAudioCache, default_tts_cache_dir, tts_cache_key
+from tts_pipeline import TTSPipeline
+from vector_index import MappedIndexStore, default_index_dir
 
 SUPPORTED_LANGUAGES = {
     'en': 'English',
@@ -180,6 +193,10 @@ SUPPORTED_LANGUAGES = {
     'ne': 'Nepali'
 }
 
+def language_label(language: Optional[str]) -> str:
+    """Metric label / span attribute for a language; client-supplied codes are unbounded"""
+    return language if language in SUPPORTED_LANGUAGES else "other"
+
 LANGUAGE_PROMPTS = {
     'hi': "कृपया हिंदी में उत्तर दें।",
     'bn': "দয়া করে বাংলায় উত্তর দিন।",
@@ -196,6 +213,7 @@ LANGUAGE_PROMPTS = {
     'ne': "कृपया नेपालीमा जवाफ दिनुहोस्।"
 }
 
+@telemetry.traced("detect_language")
 def detect_language(text: str) -> str:
     """Detect language of input text"""
     if not LANGDETECT_AVAILABLE:
@@ -225,35 +243,152 @@ def detect_language(text: str) -> str:
 
 load_dotenv()
 
-llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", temperature=0.7)
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+logger = logging.getLogger(__name__)
+
+# Sessions and cache entries every worker (and host) can see; memory:// by default
+state_store = backends.create_state_store()
+SESSION_TTL_SECONDS = float(os.environ.get("SESSION_TTL_SECONDS", 7 * 24 * 3600))
+SESSION_MAX_MESSAGES = int(os.environ.get("SESSION_MAX_MESSAGES", 50))
+shared_embedding_cache = None if isinstance(state_store, InMemoryStateStore) else SharedCache(
+    state_store, "query_embedding",
+    ttl=float(os.environ.get("CACHE_TTL_SECONDS", 24 * 3600)),
+    local_size=int(os.environ.get("RETRIEVAL_CACHE_SIZE", 1024)),
+)
+
+def session_key(session_id: str) -> str:
+    return f"session:{session_id}:turns"
 
-loader = TextLoader("nabardDetails.txt", encoding="utf-8")
-docs = loader.load()
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=1500,  # Increased for better context
-    chunk_overlap=300,  # More overlap for continuity
-    separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""]
+def load_session(session_id: str) -> list:
+    """Conversation history for a session, read in a single store round trip"""
+    try:
+        with telemetry.span("session.load"):
+            turns = state_store.get_list(session_key(session_id))
+    except STORE_ERRORS as e:
+        # Answer without history rather than not at all
+        telemetry.STATE_STORE_ERRORS.labels("session.load").inc()
+        telemetry.record_error("session.load", e)
+        return []
+    return [message for turn in turns for message in messages_from_dict(turn)]
+
+def save_session(session_id: str, user_message: str, reply: str):
+    """Append one turn; concurrent turns from any worker are all kept"""
+    turn = messages_to_dict([HumanMessage(content=user_message), AIMessage(content=reply)])
+    try:
+        with telemetry.span("session.save"):
+            state_store.append(
+                session_key(session_id), [turn],
+                max_length=max(1, SESSION_MAX_MESSAGES // 2),
+                ttl=SESSION_TTL_SECONDS,
+            )
+    except STORE_ERRORS as e:
+        telemetry.STATE_STORE_ERRORS.labels("session.save").inc()
+        telemetry.record_error("session.save", e)
+
+# Built by warmup() off the event loop; requests that need them wait for /ready
+llm = None
+embeddings = None
+query_embeddings = None
+knowledge_base = None
+ready = threading.Event()
+startup_error: Optional[str] = None
+startup_failed = False
+warmup_seconds: Optional[float] = None
+
+def warmup():
+    """Run warm_up_once until it succeeds, backing off between failed attempts"""
+    global query_embeddings, startup_error, startup_failed, warmup_seconds
+    attempts = max(1, int(os.environ.get("WARMUP_ATTEMPTS", 5)))
+    backoff = float(os.environ.get("WARMUP_BACKOFF_SECONDS", 2))
+    started = time.perf_counter()
+    for attempt in range(1, attempts + 1):
+        try:
+            warm_up_once()
+            break
+        except Exception as e:
+            startup_error = f"{type(e).__name__}: {e}"
+            telemetry.record_error("warmup", e)
+            logger.warning("Warmup attempt %d/%d failed: %s", attempt, attempts, startup_error)
+            # Don't leak the batcher thread of a half-finished attempt
+            if isinstance(query_embeddings, EmbeddingBatcher):
+                query_embeddings.close()
+            query_embeddings = None
+            if attempt < attempts:
+                time.sleep(min(backoff * 2 ** (attempt - 1), 60))
+    else:
+        # Out of attempts: /health fails too, so the orchestrator restarts the worker
+        startup_failed = True
+        logger.error("Warmup gave up after %d attempts", attempts)
+        return
+    startup_error = None
+    warmup_seconds = round(time.perf_counter() - started, 3)
+    ready.set()
+    logger.info("Warmup finished in %.2fs", warmup_seconds)
+
+def warm_up_once():
+    """Create the model clients and map the knowledge base index"""
+    global llm, embeddings, query_embeddings, knowledge_base
+    with telemetry.span("warmup"):
+        llm = backends.create_llm()
+        embeddings = backends.create_embeddings()
+        # /chat detects languages on the event loop; load langdetect's profiles now
+        detect_language("warm up the language detector")
+        query_embeddings = embeddings
+        # Concurrent /chat queries share one embedding call per window
+        if float(os.environ.get("EMBED_BATCH_WINDOW_MS", 8)) > 0:
+            query_embeddings = EmbeddingBatcher(
+                embeddings,
+                window_ms=float(os.environ.get("EMBED_BATCH_WINDOW_MS", 8)),
+                max_batch=int(os.environ.get("EMBED_BATCH_MAX_SIZE", 32)),
+                max_concurrent_batches=int(os.environ.get("EMBED_BATCH_CONCURRENCY", 4)),
+                timeout=float(os.environ.get("EMBED_BATCH_TIMEOUT_SECONDS", 30)),
+            )
+        base = KnowledgeBase(
+            os.environ.get("KNOWLEDGE_BASE_DIR", "knowledge_base"),
+            embeddings,
+            build_retriever=lambda index: HybridRetriever(
+                index, query_embeddings, k=6,
+                cache_size=int(os.environ.get("RETRIEVAL_CACHE_SIZE", 1024)),
+                embedding_cache=shared_embedding_cache,
+            ),
+            splitter_kwargs={
+                "chunk_size": 1500,  # Increased for better context
+                "chunk_overlap": 300,  # More overlap for continuity
+                "separators": ["\n\n", "\n", ".", "!", "?", ",", " ", ""],
+            },
+            # Every worker on the host maps the same files instead of holding its own copy
+            index_store=MappedIndexStore(os.environ.get("INDEX_DIR") or default_index_dir()),
+            batch_size=int(os.environ.get("KB_EMBED_BATCH_SIZE", 64)),
+            workers=int(os.environ.get("KB_INGEST_WORKERS", 2)),
+            keep_versions=int(os.environ.get("KB_KEEP_VERSIONS", 3)),
+        )
+        base.reload()
+        base.start_watching(float(os.environ.get("KB_RELOAD_INTERVAL", 30)))
+        knowledge_base = base
+
+def require_ready():
+    if not ready.is_set():
+        raise HTTPException(
+            status_code=503,
+            detail=startup_error or "Service is warming up",
+            headers={"Retry-After": "5"},
+        )
+
+context_assembler = ContextAssembler(
+    total_tokens=int(os.environ.get("CONTEXT_TOKEN_BUDGET", 8000)),
+    shares=parse_shares(os.environ.get("CONTEXT_BUDGET_SHARES")),
 )
-splits = text_splitter.split_documents(docs)
-nabard_vectorstore = Chroma.from_documents(splits, embeddings)
-nabard_retriever = nabard_vectorstore.as_retriever(search_kwargs={"k": 6})  # More results
 
-def enhanced_nabard_rag_search_tool(query: str, language: str = 'en') -> str:
+def enhanced_nabard_rag_search_tool(query: str, language: str = 'en', budget: Optional[RequestBudget] = None) -> str:
     """Enhanced NABARD search with better context understanding"""
+    budget = budget or context_assembler.new_request()
     try:
         # Analyze query for better search strategy
         analysis = analyze_and_enhance_query(query, language)
-        search_query = analysis['enhanced_query']
         
-        # Create context-aware search query
-        context_keywords = "carbon farming agroforestry rice cultivation NABARD financing schemes"
-        enhanced_query = f"{search_query} {context_keywords}"
-        
-        docs = nabard_retriever.invoke(enhanced_query)
-        if not docs:
-            # Try with original query if enhanced search fails
-            docs = nabard_retriever.invoke(query)
+        # Exact terms (scheme names, acronyms, numbers) go to the lexical index,
+        # the enhanced query only steers the vector side
+        docs = knowledge_base.retriever.invoke(query, vector_query=analysis['enhanced_query'])
             
         if not docs:
             return "No relevant NABARD information found. Please try web search for current information."
@@ -265,30 +400,35 @@ def enhanced_nabard_rag_search_tool(query: str, language: str = 'en') -> str:
             if content and len(content) > 50:  # Filter out very short content
                 context_parts.append(content)
         
+        # Overlapping neighbours are stitched together, then kept in rank order until the budget runs out
+        context_parts = budget.fit_chunks(context_parts)
         if not context_parts:
-            return "No relevant NABARD information found. Please try web search for current information."
+            # Relevant passages exist, this request has either seen them all or has no room left
+            return ("No new NABARD information: the relevant passages were already provided above "
+                    "or the context budget for this question is exhausted. Answer from the information already gathered.")
             
-        context = "\n\n".join(context_parts[:4])  # Top 4 most relevant
+        context = "\n\n".join(context_parts)
         
         # Add language instruction if not English
         lang_instruction = LANGUAGE_PROMPTS.get(language, "")
         
         return f"NABARD Knowledge Base Information:\n{context}\n\nLanguage: {lang_instruction}"
     except Exception as e:
+        telemetry.record_error("tool.nabard_rag_search", e)
         return f"Error in NABARD search: {str(e)}"
 
 # ======================
 # ENHANCED WEB SCRAPER
 # ======================
-def enhanced_web_scraper_tool(url: str, language: str = 'en') -> str:
+def enhanced_web_scraper_tool(url: str, language: str = 'en', budget: Optional[RequestBudget] = None) -> str:
     """Enhanced web scraper with better content extraction"""
+    budget = budget or context_assembler.new_request()
     try:
         headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
-        response = requests.get(url, headers=headers, timeout=15)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.content, 'html.parser')
+        page = backends.fetch_page(url, headers=headers, timeout=15)
+        soup = BeautifulSoup(page, 'html.parser')
 
         # Remove noise elements
         for element in soup(["script", "style", "nav", "footer", "header", "aside", "advertisement", "ads"]):
@@ -329,13 +469,15 @@ def enhanced_web_scraper_tool(url: str, language: str = 'en') -> str:
         # Add language instruction
         lang_instruction = LANGUAGE_PROMPTS.get(language, "")
         
-        return f"Web Content from {url}:\n{content[:6000]}\n\nLanguage: {lang_instruction}"
+        return f"Web Content from {url}:\n{budget.fit_tool_output(content)}\n\nLanguage: {lang_instruction}"
     except Exception as e:
+        telemetry.record_error("tool.web_scraper", e)
         return f"Error scraping {url}: {str(e)}"
 
 
-def enhanced_web_search_tool(query: str, language: str = 'en') -> str:
+def enhanced_web_search_tool(query: str, language: str = 'en', budget: Optional[RequestBudget] = None) -> str:
     """Enhanced web search with context-aware queries"""
+    budget = budget or context_assembler.new_request()
     try:
 
         analysis = analyze_and_enhance_query(query, language)
@@ -351,36 +493,38 @@ def enhanced_web_search_tool(query: str, language: str = 'en') -> str:
         else:
             enhanced_query = f"{query} carbon markets agriculture India sustainable farming"
         
-        search_tool = DuckDuckGoSearchRun()
-        results = search_tool.run(enhanced_query)
+        results = backends.web_search(enhanced_query)
 
         lang_instruction = LANGUAGE_PROMPTS.get(language, "")
         
-        return f"Current Web Search Results:\n{results}\n\nLanguage: {lang_instruction}"
+        return f"Current Web Search Results:\n{budget.fit_tool_output(results)}\n\nLanguage: {lang_instruction}"
     except Exception as e:
+        telemetry.record_error("tool.web_search", e)
         return f"Error in web search: {str(e)}"
 
 
-def create_context_aware_tools(language: str = 'en'):
+def create_context_aware_tools(language: str = 'en', budget: Optional[RequestBudget] = None):
     """Create tools with language context"""
+    budget = budget or context_assembler.new_request()
     return [
         Tool(
             name="nabard_rag_search",
             description="Search NABARD knowledge base for carbon farming, agroforestry, and agricultural finance information.",
-            func=lambda query: enhanced_nabard_rag_search_tool(query, language)
+            func=telemetry.traced("tool.nabard_rag_search")(lambda query: enhanced_nabard_rag_search_tool(query, language, budget))
         ),
         Tool(
             name="web_scraper",
             description="Scrape content from websites. Use for specific URLs only.",
-            func=lambda url: enhanced_web_scraper_tool(url, language)
+            func=telemetry.traced("tool.web_scraper")(lambda url: enhanced_web_scraper_tool(url, language, budget))
         ),
         Tool(
             name="web_search",
             description="Search the web for current information about carbon markets, agriculture, and sustainability.",
-            func=lambda query: enhanced_web_search_tool(query, language)
+            func=telemetry.traced("tool.web_search")(lambda query: enhanced_web_search_tool(query, language, budget))
         )
     ]
 
+@telemetry.traced("analyze_query")
 def analyze_and_enhance_query(query: str, language: str = 'en') -> dict:
     """Analyze user query and determine best response strategy"""
     
@@ -445,7 +589,10 @@ def analyze_and_enhance_query(query: str, language: str = 'en') -> dict:
     
     return analysis
 
-def get_enhanced_agent_prompt(language: str = 'en') -> ChatPromptTemplate:
+# Prompt sections that are never dropped to fit the token budget
+REQUIRED_PROMPT_SECTIONS = ("You are CarbonBot", "LANGUAGE CONTEXT:", "4. Search Strategy:", "RESPONSE TONE:")
+
+def get_enhanced_agent_prompt(language: str = 'en', query: str = "", budget: Optional[RequestBudget] = None) -> ChatPromptTemplate:
     """Get language-aware agent prompt"""
     
     language_name = SUPPORTED_LANGUAGES.get(language, 'English')
@@ -544,6 +691,13 @@ RESPONSE TONE:
 - Culturally sensitive and India-focused
 """
 
+    if budget is not None:
+        sections = [
+            (section, section.startswith(REQUIRED_PROMPT_SECTIONS))
+            for section in ENHANCED_CONTEXT.strip().split("\n\n")
+        ]
+        ENHANCED_CONTEXT = budget.fit_sections(sections, query)
+
     return ChatPromptTemplate.from_messages([
         ("system", ENHANCED_CONTEXT),
         MessagesPlaceholder(variable_name="chat_history"),
@@ -551,7 +705,18 @@ RESPONSE TONE:
         MessagesPlaceholder(variable_name="agent_scratchpad")
     ])
 
-app = FastAPI(title="Multilingual Carbon Market Assistant", version="2.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Accept connections right away; /ready reports when warmup is done
+    threading.Thread(target=warmup, name="warmup", daemon=True).start()
+    yield
+    if knowledge_base is not None:
+        knowledge_base.stop_watching()
+    if isinstance(query_embeddings, EmbeddingBatcher):
+        query_embeddings.close()
+    state_store.close()
+
+app = FastAPI(title="Multilingual Carbon Market Assistant", version="2.0", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -559,89 +724,286 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(telemetry.TelemetryMiddleware)
+telemetry.configure_exporters(
+    trace_file=os.environ.get("TRACE_FILE"),
+    collector_url=os.environ.get("TRACE_COLLECTOR_URL"),
+)
 
-memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+# Probes run on the event loop so a saturated threadpool cannot make a live worker look dead
+@app.get("/health")
+async def health():
+    if startup_failed:
+        return JSONResponse(status_code=503, content={"data": {"status": "failed", "error": startup_error}})
+    return {"data": {"status": "ok"}}
+
+@app.get("/ready")
+async def readiness():
+    if ready.is_set():
+        return {"data": {"ready": True, "version": knowledge_base.version, "warmup_seconds": warmup_seconds}}
+    return JSONResponse(
+        status_code=503,
+        content={"data": {"ready": False, "error": startup_error, "failed": startup_failed}},
+        headers={"Retry-After": "5"},
+    )
+
+@app.get("/metrics")
+async def metrics():
+    payload, content_type = telemetry.metrics_payload()
+    return Response(payload, media_type=content_type)
+
+class RollbackRequest(BaseModel):
+    version: Optional[str] = None
+
+KB_ADMIN_TOKEN = os.environ.get("KB_ADMIN_TOKEN")
+LOCAL_CLIENTS = {"127.0.0.1", "::1"}
+
+def require_admin(http_request: Request):
+    """KB admin calls need KB_ADMIN_TOKEN as a bearer token; without one, only local callers"""
+    if KB_ADMIN_TOKEN:
+        scheme, _, token = http_request.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(token.strip().encode(), KB_ADMIN_TOKEN.encode()):
+            raise HTTPException(status_code=401, detail="Admin token required", headers={"WWW-Authenticate": "Bearer"})
+        return
+    # Behind a reverse proxy on the same host every caller looks local: set the token there
+    client = http_request.client.host if http_request.client else None
+    if client not in LOCAL_CLIENTS:
+        raise HTTPException(status_code=403, detail="Set KB_ADMIN_TOKEN to manage the knowledge base remotely")
+
+@app.get("/kb/status")
+def kb_status():
+    require_ready()
+    return {"data": knowledge_base.status()}
+
+@app.post("/kb/reload")
+def kb_reload(http_request: Request):
+    require_admin(http_request)
+    require_ready()
+    try:
+        report = knowledge_base.reload(force=True)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"data": {"report": report, **knowledge_base.status()}}
+
+@app.post("/kb/rollback")
+def kb_rollback(request: RollbackRequest, http_request: Request):
+    require_admin(http_request)
+    require_ready()
+    try:
+        knowledge_base.rollback(request.version)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"data": knowledge_base.status()}
 
 class ChatRequest(BaseModel):
     message: str
     language: Optional[str] = None
+    # Requests without one share a single conversation, as before sessions existed
+    session_id: Optional[str] = None
 
 class SpeakRequest(BaseModel):
     message: str
     language: Optional[str] = None
 
-@app.post("/chat")
-def chat(request: ChatRequest):
-    try:
-        detected_language = request.language or detect_language(request.message)
+# Localised replies for requests that fail or are turned away under load
+ERROR_MESSAGES = {
+    'error': {
+        'en': "I'm experiencing technical issues. Please try again.",
+        'hi': "मुझे तकनीकी समस्या हो रही है। कृपया फिर से कोशिश करें।",
+        'bn': "আমার কারিগরি সমস্যা হচ্ছে। দয়া করে আবার চেষ্টা করুন।",
+        'te': "నాకు సాంకేతిక సమస్యలు ఎదురవుతున్నాయి. దయచేసి మళ్ళీ ప్రయత్నించండి।",
+        'ta': "எனக்கு தொழில்நுட்ப சிக்கல்கள் உள்ளன. தயவுசெய்து மீண்டும் முயற்சிக்கவும்।"
+    },
+    'busy': {
+        'en': "I'm answering a lot of questions right now. Please try again in a few seconds.",
+        'hi': "अभी बहुत सारे सवाल आ रहे हैं। कृपया कुछ सेकंड बाद फिर से कोशिश करें।",
+        'bn': "এই মুহূর্তে অনেক প্রশ্ন আসছে। দয়া করে কয়েক সেকেন্ড পরে আবার চেষ্টা করুন।",
+        'te': "ప్రస్తుతం చాలా ప్రశ్నలు వస్తున్నాయి. దయచేసి కొన్ని సెకన్ల తర్వాత మళ్ళీ ప్రయత్నించండి।",
+        'ta': "இப்போது நிறைய கேள்விகள் வருகின்றன. தயவுசெய்து சில வினாடிகள் கழித்து மீண்டும் முயற்சிக்கவும்।"
+    }
+}
 
-        tools = create_context_aware_tools(detected_language)
-        agent_prompt = get_enhanced_agent_prompt(detected_language)
-        
+def localized_message(kind: str, language: str) -> str:
+    messages = ERROR_MESSAGES[kind]
+    return messages.get(language, messages['en'])
+
+admission = AdmissionController(
+    max_concurrency=int(os.environ.get("CHAT_MAX_CONCURRENCY", 8)),
+    min_concurrency=int(os.environ.get("CHAT_MIN_CONCURRENCY", 1)),
+    per_session=int(os.environ.get("CHAT_SESSION_CONCURRENCY", 1)),
+    queue_size=int(os.environ.get("CHAT_QUEUE_SIZE", 32)),
+    service_estimate=float(os.environ.get("CHAT_SERVICE_ESTIMATE_SECONDS", 2)),
+)
+CHAT_QUEUE_TIMEOUT_SECONDS = float(os.environ.get("CHAT_QUEUE_TIMEOUT_SECONDS", 10))
+SHORT_MESSAGE_CHARS = int(os.environ.get("CHAT_SHORT_MESSAGE_CHARS", 80))
+LONG_MESSAGE_CHARS = int(os.environ.get("CHAT_LONG_MESSAGE_CHARS", 500))
+# Questions answered recently hit the retrieval and embedding caches
+recent_questions = LRUCache(int(os.environ.get("RETRIEVAL_CACHE_SIZE", 1024)))
+
+def chat_priority(message: str) -> int:
+    """0 for short or recently asked questions, 2 for long or URL-scraping runs, else 1"""
+    if len(message) <= SHORT_MESSAGE_CHARS or recent_questions.get(normalize_query(message)):
+        return 0
+    if len(message) > LONG_MESSAGE_CHARS or re.search(r"https?://", message):
+        return 2
+    return 1
+
+@app.get("/admission/status")
+async def admission_status():
+    return {"data": admission.status()}
+
+def run_chat_agent(request: ChatRequest, language: str, session_id: str) -> str:
+    """One agent turn: assemble the prompt, run the agent and save the exchange"""
+    budget = context_assembler.new_request()
+    budget.record_input(request.message)
+    tools = create_context_aware_tools(language, budget)
+    agent_prompt = get_enhanced_agent_prompt(language, request.message, budget)
+    session_history = load_session(session_id)
+    chat_history = budget.fit_history(session_history)
+
+    outcome = "error"
+    try:
         agent = create_openai_functions_agent(llm, tools, agent_prompt)
         agent_executor = AgentExecutor(
-            agent=agent, 
-            tools=tools, 
-            memory=memory, 
-            verbose=True, 
+            agent=agent,
+            tools=tools,
+            verbose=os.environ.get("AGENT_VERBOSE", "false").lower() == "true",
             max_iterations=3,
             early_stopping_method="generate"
         )
-        
 
-        response = agent_executor.invoke({"input": request.message})
+        with telemetry.span("agent"):
+            response = agent_executor.invoke(
+                {"input": request.message, "chat_history": chat_history},
+                config={"callbacks": [telemetry.llm_callback]},
+            )
         reply = response.get("output", "I couldn't generate a response.")
-        
+        save_session(session_id, request.message, reply)
+        outcome = "ok"
+        return reply
+    finally:
+        # Failed and rate-limited turns spent tokens too
+        context_assembler.log_usage(budget, language=language, history_messages=len(chat_history), outcome=outcome)
+
+def busy_response(language: str, retry_after: float) -> JSONResponse:
+    # Same 200 shape as the error path so the client shows the reply;
+    # Retry-After still tells well-behaved callers when to come back
+    return JSONResponse(
+        content={
+            "data": {
+                "reply": localized_message('busy', language),
+                "language": language,
+                "error": True,
+                "busy": True
+            }
+        },
+        headers={"Retry-After": str(int(retry_after))},
+    )
+
+@app.post("/chat")
+async def chat(request: ChatRequest, http_request: Request):
+    require_ready()
+    # Queueing time counts from arrival, not from when this handler got to run
+    arrived_at = getattr(http_request.state, "arrived_at", time.monotonic())
+    detected_language = request.language or 'en'
+    session_id = request.session_id or "default"
+    try:
+        detected_language = request.language or detect_language(request.message)
+        telemetry.set_language(language_label(detected_language))
+
+        # Waiting happens on the event loop; only admitted turns take a worker thread.
+        # Anonymous requests share one conversation, so only real sessions get a per-session limit
+        async with admission.admit(request.session_id, chat_priority(request.message),
+                                   deadline=arrived_at + CHAT_QUEUE_TIMEOUT_SECONDS):
+            reply = await run_in_threadpool(run_chat_agent, request, detected_language, session_id)
+        recent_questions.put(normalize_query(request.message), True)
+
         return {
             "data": {
                 "reply": reply,
                 "language": detected_language,
-                "language_name": SUPPORTED_LANGUAGES.get(detected_language, "English")
+                "language_name": SUPPORTED_LANGUAGES.get(detected_language, "English"),
+                "session_id": session_id
             }
         }
+    except Overloaded as e:
+        return busy_response(detected_language, e.retry_after)
     except Exception as e:
-        error_message = "I'm experiencing technical issues. Please try again."
-        if detected_language in LANGUAGE_PROMPTS:
-
-            error_messages = {
-                'hi': "मुझे तकनीकी समस्या हो रही है। कृपया फिर से कोशिश करें।",
-                'bn': "আমার কারিগরি সমস্যা হচ্ছে। দয়া করে আবার চেষ্টা করুন।",
-                'te': "నాకు సాంకేతిక సమస్యలు ఎదురవుతున్నాయి. దయచేసి మళ్ళీ ప్రయత్నించండి।",
-                'ta': "எனக்கு தொழில்நுட்ப சிக்கல்கள் உள்ளன. தயவுசெய்து மீண்டும் முயற்சிக்கவும்।"
-            }
-            error_message = error_messages.get(detected_language, error_message)
-        
+        telemetry.record_error("chat", e)
+        if is_rate_limit_error(e):
+            # Upstream quota ran out mid-run; the limit has already been cut
+            return busy_response(detected_language, admission.cooldown)
         return {
             "data": {
-                "reply": error_message,
+                "reply": localized_message('error', detected_language),
                 "language": detected_language,
                 "error": True
             }
         }
 
+tts_cache = TTSAudioCache(
+    os.environ.get("TTS_CACHE_DIR") or default_tts_cache_dir(),
+    int(os.environ.get("TTS_CACHE_MAX_BYTES", 256 * 1024 * 1024)),
+)
+
+tts_pipeline = TTSPipeline(
+    backends.create_tts_backend(),
+    max_workers=int(os.environ.get("TTS_MAX_WORKERS", 4)),
+    max_in_flight=int(os.environ.get("TTS_MAX_IN_FLIGHT", 3)),
+)
+
+TTS_LANG_MAP = {
+    'hi': 'hi', 'bn': 'bn', 'te': 'te', 'ta': 'ta',
+    'mr': 'mr', 'gu': 'gu', 'kn': 'kn', 'ml': 'ml',
+    'pa': 'pa', 'ur': 'ur', 'ne': 'ne'
+}
+
 @app.post("/speak")
-def speak(request: SpeakRequest):
+def speak(request: SpeakRequest, http_request: Request):
     try:
         language = request.language or detect_language(request.message)
+        telemetry.set_language(language_label(language))
+        tts_lang = TTS_LANG_MAP.get(language, 'en')
 
-        tts_lang_map = {
-            'hi': 'hi', 'bn': 'bn', 'te': 'te', 'ta': 'ta', 
-            'mr': 'mr', 'gu': 'gu', 'kn': 'kn', 'ml': 'ml',
-            'pa': 'pa', 'ur': 'ur', 'ne': 'ne'
+        key = tts_cache_key(request.message, tts_lang, slow=False)
+        etag = f'"{key}"'
+        headers = {
+            "Content-Disposition": f"attachment; filename=speech_{language_label(language)}.mp3",
+            "Cache-Control": "private, max-age=86400",
+            "ETag": etag,
         }
-        tts_lang = tts_lang_map.get(language, 'en')
-        
-        tts = gTTS(text=request.message, lang=tts_lang, slow=False)
-        audio_buffer = BytesIO()
-        tts.write_to_fp(audio_buffer)
-        audio_buffer.seek(0)
-        
+
+        if etag in http_request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+
+        cached_path = tts_cache.lookup(key)
+        cached_stat = None
+        if cached_path:
+            try:
+                cached_stat = os.stat(cached_path)
+            except FileNotFoundError:
+                # Evicted by another worker since the lookup; synthesise it again
+                cached_path = None
+        telemetry.record_cache("tts_audio", cached_path is not None)
+        if cached_path:
+            # FileResponse streams from disk and answers Range requests itself; the lookup
+            # refreshed the file's mtime, so eviction leaves it alone while it is sent
+            return FileResponse(cached_path, media_type="audio/mpeg", headers=headers, stat_result=cached_stat)
+
+        # Sentences are synthesised in parallel, so playback starts after the first one
+        chunks = tts_pipeline.stream(request.message, tts_lang, slow=False)
+        # Pull the first chunk eagerly so synthesis failures still fall back to empty audio
+        first_chunk = next(chunks, b"")
+        if not first_chunk:
+            return StreamingResponse(BytesIO(b""), media_type="audio/mpeg")
+
         return StreamingResponse(
-            BytesIO(audio_buffer.read()),
+            tts_cache.stream_and_store(key, chain([first_chunk], chunks)),
             media_type="audio/mpeg",
-            headers={"Content-Disposition": f"attachment; filename=speech_{language}.mp3"}
+            headers=headers
         )
     except Exception as e:
+        telemetry.record_error("tts", e)
         return StreamingResponse(BytesIO(b""), media_type="audio/mpeg")
     
 if __name__ == "__main__":
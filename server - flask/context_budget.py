@@ -0,0 +1,235 @@
+import logging
+import math
+import re
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from retrieval import tokenize
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+    TIKTOKEN_AVAILABLE = True
+except Exception:
+    _ENCODING = None
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SHARES = {
+    'system': 0.35,
+    'history': 0.25,
+    'retrieval': 0.25,
+    'tools': 0.15,
+}
+
+# Chunks from the splitter share up to 300 characters with their neighbours
+MIN_OVERLAP_CHARS = 40
+MAX_OVERLAP_CHARS = 400
+SENTENCE_END = re.compile(r"[.!?।॥۔\n]")
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens, falling back to a script-aware estimate without tiktoken"""
+    if not text:
+        return 0
+    if TIKTOKEN_AVAILABLE:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    # Latin text averages ~4 characters per token, Indic scripts closer to 2
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return math.ceil(ascii_chars / 4 + (len(text) - ascii_chars) / 2)
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to fit ``max_tokens``, preferring a sentence boundary"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    cut = text[:low]
+    boundary = max((match.end() for match in SENTENCE_END.finditer(cut)), default=0)
+    if boundary > len(cut) // 2:
+        cut = cut[:boundary]
+    return cut.rstrip()
+
+
+def _merge_overlap(first: str, second: str) -> Optional[str]:
+    """Join two chunks if the end of ``first`` is the start of ``second``"""
+    probe = second[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return None
+    tail_start = max(0, len(first) - MAX_OVERLAP_CHARS)
+    position = first.find(probe, tail_start)
+    while position != -1:
+        if second.startswith(first[position:]):
+            return first[:position] + second
+        position = first.find(probe, position + 1)
+    return None
+
+
+def deduplicate_chunks(chunks: Sequence[str]) -> List[str]:
+    """Drop contained chunks and stitch overlapping neighbours, keeping rank order"""
+    kept: List[str] = []
+    for chunk in chunks:
+        chunk = chunk.strip()
+        if not chunk:
+            continue
+        for index, existing in enumerate(kept):
+            if chunk in existing:
+                break
+            if existing in chunk:
+                kept[index] = chunk
+                break
+            merged = _merge_overlap(existing, chunk) or _merge_overlap(chunk, existing)
+            if merged:
+                kept[index] = merged
+                break
+        else:
+            kept.append(chunk)
+    return kept
+
+
+class RequestBudget:
+    """Token allowance for a single chat request, split across prompt sections.
+
+    Every ``fit_*`` call records what it kept, so ``usage()`` reports how much
+    of each share the request actually sent to the model.
+    """
+
+    def __init__(self, total_tokens: int, shares: Dict[str, float]):
+        self.total_tokens = total_tokens
+        self.limits = {name: int(total_tokens * share) for name, share in shares.items()}
+        self.used = {name: 0 for name in self.limits}
+        self.used['input'] = 0
+        self._sent_chunks: List[str] = []
+        self._lock = threading.Lock()
+
+    def remaining(self, section: str) -> int:
+        with self._lock:
+            return max(0, self.limits.get(section, 0) - self.used.get(section, 0))
+
+    def _record(self, section: str, tokens: int):
+        with self._lock:
+            self.used[section] = self.used.get(section, 0) + tokens
+
+    def fit_sections(self, sections: Sequence[Tuple[str, bool]], query: str) -> str:
+        """Assemble the system prompt, dropping the least relevant optional sections first.
+
+        ``sections`` are ``(text, required)`` pairs in prompt order; when the
+        prompt does not fit, optional sections with the lowest term overlap
+        with the query are removed until it does.
+        """
+        costs = [count_tokens(text) for text, _ in sections]
+        limit = self.limits.get('system', 0)
+        keep = [True] * len(sections)
+        total = sum(costs)
+        if total > limit:
+            query_terms = set(tokenize(query))
+            optional = [
+                (len(query_terms & set(tokenize(text))), -index, index)
+                for index, (text, required) in enumerate(sections) if not required
+            ]
+            # Least relevant first; among ties, later sections go first
+            for _, _, index in sorted(optional):
+                if total <= limit:
+                    break
+                keep[index] = False
+                total -= costs[index]
+        self._record('system', total)
+        return "\n\n".join(text for (text, _), kept in zip(sections, keep) if kept)
+
+    def fit_history(self, messages: Sequence) -> list:
+        """Keep the most recent messages that fit the history share"""
+        remaining = self.remaining('history')
+        kept = []
+        for message in reversed(messages):
+            tokens = count_tokens(str(message.content))
+            if tokens > remaining:
+                break
+            kept.append(message)
+            remaining -= tokens
+        kept.reverse()
+        self._record('history', sum(count_tokens(str(message.content)) for message in kept))
+        return kept
+
+    def fit_chunks(self, chunks: Sequence[str], min_tokens: int = 64,
+                   call_share: float = 0.5, floor_tokens: int = 256) -> List[str]:
+        """Deduplicate retrieved chunks and keep the most relevant new ones that fit.
+
+        One call may spend at most ``call_share`` of the retrieval share, so a
+        second search in the same request still gets room, and never less than
+        ``floor_tokens``. Chunks already sent earlier in the request are skipped.
+        """
+        limit = self.limits.get('retrieval', 0)
+        remaining = max(min(self.remaining('retrieval'), int(limit * call_share)), min(floor_tokens, limit))
+        with self._lock:
+            sent = list(self._sent_chunks)
+        kept = []
+        for chunk in deduplicate_chunks(chunks):
+            if any(chunk in previous for previous in sent):
+                continue
+            tokens = count_tokens(chunk)
+            if tokens > remaining:
+                if remaining >= min_tokens:
+                    truncated = truncate_to_tokens(chunk, remaining)
+                    kept.append(truncated)
+                    # Only the cut text reached the model; a later search may send the whole chunk
+                    sent.append(truncated)
+                    remaining = 0
+                break
+            kept.append(chunk)
+            sent.append(chunk)
+            remaining -= tokens
+        with self._lock:
+            self._sent_chunks = sent
+        self._record('retrieval', sum(count_tokens(chunk) for chunk in kept))
+        return kept
+
+    def fit_tool_output(self, text: str) -> str:
+        """Trim a tool result to what is left of the tool share for this request"""
+        fitted = truncate_to_tokens(text, self.remaining('tools'))
+        self._record('tools', count_tokens(fitted))
+        return fitted
+
+    def record_input(self, text: str):
+        self._record('input', count_tokens(text))
+
+    def usage(self) -> dict:
+        with self._lock:
+            used = dict(self.used)
+        return {**used, 'total': sum(used.values()), 'budget': self.total_tokens}
+
+
+class ContextAssembler:
+    """Per-request token budgets for the agent prompt"""
+
+    def __init__(self, total_tokens: int = 8000, shares: Optional[Dict[str, float]] = None):
+        shares = shares or DEFAULT_SHARES
+        scale = sum(shares.values()) or 1.0
+        self.total_tokens = total_tokens
+        self.shares = {name: share / scale for name, share in shares.items()}
+
+    def new_request(self) -> RequestBudget:
+        return RequestBudget(self.total_tokens, self.shares)
+
+    def log_usage(self, budget: RequestBudget, **fields):
+        logger.info("Context token usage: %s", {**fields, **budget.usage()})
+
+
+def parse_shares(value: Optional[str]) -> Dict[str, float]:
+    """Parse ``system=0.35,history=0.25,...`` into a share mapping"""
+    if not value:
+        return dict(DEFAULT_SHARES)
+    shares = dict(DEFAULT_SHARES)
+    for item in value.split(","):
+        name, _, share = item.partition("=")
+        if name.strip() in shares and share.strip():
+            shares[name.strip()] = float(share)
+    return shares
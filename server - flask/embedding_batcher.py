@@ -0,0 +1,145 @@
+import inspect
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+
+import telemetry
+
+_STOP = object()
+
+
+class EmbeddingBatcher(Embeddings):
+    """Coalesce concurrent ``embed_query`` calls into batched ``embed_documents`` calls.
+
+    The first query to arrive opens a window of ``window_ms``; every query
+    that arrives before it closes (or until ``max_batch`` are waiting) is
+    embedded in the same upstream call or forward pass, and each caller gets
+    its own vector back. Up to ``max_concurrent_batches`` batches run at once
+    so a slow remote call does not hold up the next window. A caller gives
+    up after ``timeout`` seconds; after ``close`` every query fails at once.
+    """
+
+    def __init__(self, base: Embeddings, window_ms: float = 8.0, max_batch: int = 32,
+                 max_concurrent_batches: int = 4, timeout: float = 30.0):
+        self.base = base
+        self.window = max(0.0, window_ms) / 1000
+        self.max_batch = max(1, max_batch)
+        self.timeout = timeout
+        # Gemini embeds documents and queries differently; keep the query task type
+        parameters = inspect.signature(base.embed_documents).parameters
+        self._query_kwargs = {"task_type": "RETRIEVAL_QUERY"} if "task_type" in parameters else {}
+        self._queue = queue.SimpleQueue()
+        # Held while enqueueing, so nothing lands behind the stop marker
+        self._lock = threading.Lock()
+        self._closed = False
+        self._slots = threading.BoundedSemaphore(max(1, max_concurrent_batches))
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_concurrent_batches),
+                                            thread_name_prefix="embed-batch")
+        self._thread = threading.Thread(target=self._collect, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def embed_query(self, text: str) -> List[float]:
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Embedding batcher is closed")
+            self._queue.put((text, time.perf_counter(), future))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # Still queued: drop it from its batch; already embedding: the result is discarded
+            future.cancel()
+            raise
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # Document embedding is already batched by the caller (ingestion)
+        return self.base.embed_documents(texts)
+
+    def close(self):
+        """Stop collecting; queries already taken run, any still queued fail"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout=1)
+        self._executor.shutdown(wait=False)
+        # The collector is stuck waiting for a slot if the join timed out
+        self._fail(self._drain(), RuntimeError("Embedding batcher is closed"))
+
+    def _drain(self) -> list:
+        items = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                items.append(item)
+        if self._thread.is_alive():
+            # Let the collector exit once it gets its slot
+            self._queue.put(_STOP)
+        return items
+
+    @staticmethod
+    def _fail(batch: list, error: Exception):
+        for _, _, future in batch:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def _collect(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch = [first]
+            window_closes = time.perf_counter() + self.window
+            stopping = False
+            while len(batch) < self.max_batch:
+                remaining = window_closes - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._slots.acquire()
+            try:
+                self._executor.submit(self._embed_batch, batch)
+            except RuntimeError as e:
+                # close() shut the executor down while this batch waited for a slot
+                self._slots.release()
+                self._fail(batch, e)
+                return
+            if stopping:
+                return
+
+    def _embed_batch(self, batch: list):
+        started = time.perf_counter()
+        try:
+            # Callers that timed out while queued cancelled their futures; skip them
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                return
+            telemetry.EMBEDDING_BATCH_SIZE.observe(len(batch))
+            for _, enqueued, _ in batch:
+                telemetry.EMBEDDING_QUEUE_DELAY.observe(started - enqueued)
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+            by_text = dict(zip(texts, self.base.embed_documents(texts, **self._query_kwargs)))
+            for text, _, future in batch:
+                future.set_result(list(by_text[text]))
+        except Exception as e:
+            # Never leave a caller waiting, whatever went wrong
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
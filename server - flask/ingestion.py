@@ -0,0 +1,297 @@
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from vector_index import MappedIndexStore, index_version
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".txt", ".md")
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def chunk_file(path: str, splitter_kwargs: dict) -> List[dict]:
+    """Stream a document from disk and split it into chunks.
+
+    Runs in a worker process. The file is read in blocks that are cut at the
+    last paragraph break, so large documents never need to be held in memory
+    at once.
+    """
+    splitter = RecursiveCharacterTextSplitter(**splitter_kwargs)
+    chunks = []
+    remainder = ""
+    with open(path, "r", encoding="utf-8", errors="replace") as handle:
+        while True:
+            block = handle.read(READ_BLOCK_SIZE)
+            text = remainder + block
+            if block:
+                cut = text.rfind("\n\n")
+                if cut <= 0:
+                    remainder = text
+                    continue
+                text, remainder = text[:cut], text[cut:]
+            else:
+                remainder = ""
+            chunks.extend({"text": chunk, "source": path} for chunk in splitter.split_text(text))
+            if not block:
+                break
+    return chunks
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def embedding_model_id(embeddings: Embeddings) -> str:
+    """Name of the embedding model, so switching models never reuses old vectors"""
+    name = getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None)
+    return f"{type(embeddings).__name__}:{name}" if name else type(embeddings).__name__
+
+
+class KnowledgeBase:
+    """Directory-backed document index with hot reload and rollback.
+
+    ``reload`` chunks every document in parallel worker processes and maps
+    the index for that exact set of chunks from ``index_store``. Only the
+    first worker to see a new version embeds it, and then only chunks the
+    current index does not already hold. The new retriever is built off to
+    the side and swapped in with a single reference assignment, so requests
+    in flight keep using the one they started with. The last few versions
+    are kept for ``rollback``.
+
+    Reloads and rollbacks publish the version to serve in ``index_store``;
+    every other worker's watcher ``follow``s it, so a rollback sent to one
+    worker behind a load balancer converges on all of them.
+    """
+
+    def __init__(self, directory: str, embeddings: Embeddings, build_retriever: Callable,
+                 splitter_kwargs: dict, index_store: MappedIndexStore, batch_size: int = 64,
+                 workers: int = 2, keep_versions: int = 3):
+        self.directory = directory
+        self.embeddings = embeddings
+        self.build_retriever = build_retriever
+        self.index_store = index_store
+        self.splitter_kwargs = splitter_kwargs
+        self.batch_size = batch_size
+        self.workers = workers
+        self.keep_versions = max(1, keep_versions)
+        self.retriever = None
+        self.history = []
+        self.last_report = None
+        self._snapshot = None
+        # Version built from the documents as last scanned, whatever is being served
+        self._content_version = None
+        self._reload_lock = threading.Lock()
+        self._swap_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+
+    @property
+    def version(self) -> Optional[str]:
+        return self.retriever.version if self.retriever else None
+
+    def _scan(self) -> Dict[str, tuple]:
+        snapshot = {}
+        for root, _, names in os.walk(self.directory):
+            for name in sorted(names):
+                if not name.lower().endswith(SUPPORTED_EXTENSIONS):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def _chunk(self, paths: List[str]) -> List[dict]:
+        if len(paths) <= 1 or self.workers <= 1:
+            return [chunk for path in paths for chunk in chunk_file(path, self.splitter_kwargs)]
+        # spawn, not fork: the server process already runs threads
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(paths)), mp_context=context) as pool:
+            results = pool.map(chunk_file, paths, [self.splitter_kwargs] * len(paths))
+            return [chunk for chunks in results for chunk in chunks]
+
+    def _known_vectors(self) -> Dict[str, np.ndarray]:
+        if self.retriever is None:
+            return {}
+        index = self.retriever.index
+        return {content_hash(text): index.matrix[chunk_id] for chunk_id, text in enumerate(index.texts())}
+
+    def _embed(self, texts: List[str], report: dict) -> np.ndarray:
+        vectors = self._known_vectors()
+        new_texts = list(dict.fromkeys(text for text in texts if content_hash(text) not in vectors))
+        for start in range(0, len(new_texts), self.batch_size):
+            batch = new_texts[start:start + self.batch_size]
+            for text, vector in zip(batch, self.embeddings.embed_documents(batch)):
+                vectors[content_hash(text)] = vector
+        report["embedded_chunks"] = len(new_texts)
+        return np.array([vectors[content_hash(text)] for text in texts], dtype=np.float32)
+
+    def reload(self, force: bool = False) -> Optional[dict]:
+        """Rebuild the index if the directory changed; returns an ingestion report"""
+        with self._reload_lock:
+            snapshot = self._scan()
+            if not force and snapshot == self._snapshot:
+                return None
+            if not snapshot:
+                raise ValueError(f"No documents found in {self.directory}")
+
+            started = time.perf_counter()
+            chunks = self._chunk(list(snapshot))
+            if not chunks:
+                raise ValueError(f"No text found in {self.directory}")
+            chunked = time.perf_counter()
+            texts = [chunk["text"] for chunk in chunks]
+            version = index_version(texts, embedding_model_id(self.embeddings))
+            # Stays 0 when another worker (or an earlier run) already wrote this version
+            embed_report = {"embedded_chunks": 0}
+            index = self.index_store.load_or_build(
+                version, texts, [chunk["source"] for chunk in chunks],
+                lambda index_texts: self._embed(index_texts, embed_report),
+            )
+            embedded = time.perf_counter()
+
+            active = self.index_store.active()
+            pinned = None
+            if not force and active and active.get("built_from") == version and active.get("version") != version:
+                # Another worker rolled these same documents back; serve what it chose
+                pinned = active["version"]
+            swap_seconds = 0.0
+            if pinned and (pinned == self.version or self._follow(pinned)):
+                if version not in self._held_versions():
+                    self.index_store.release(version)
+            else:
+                # Serve these documents (a rollback target that vanished unpins them too)
+                if version != self.version:
+                    swap_seconds = self._swap(self.build_retriever(index))
+                self.index_store.publish(version, version)
+            built = time.perf_counter()
+            self._snapshot = snapshot
+            self._content_version = version
+
+            total_bytes = sum(size for _, size in snapshot.values())
+            elapsed = built - started
+            self.last_report = {
+                "version": self.version,
+                "files": len(snapshot),
+                "bytes": total_bytes,
+                "chunks": len(chunks),
+                "embedded_chunks": embed_report["embedded_chunks"],
+                "chunk_seconds": round(chunked - started, 3),
+                "embed_seconds": round(embedded - chunked, 3),
+                "build_seconds": round(built - embedded, 3),
+                "chunks_per_second": round(len(chunks) / elapsed, 1) if elapsed else None,
+                "bytes_per_second": round(total_bytes / elapsed, 1) if elapsed else None,
+                "swap_ms": round(swap_seconds * 1000, 3),
+            }
+            logger.info("Knowledge base ingested: %s", self.last_report)
+            return self.last_report
+
+    def follow(self) -> bool:
+        """Serve the version another worker published for these documents, if it differs"""
+        with self._reload_lock:
+            active = self.index_store.active()
+            if (not active or self._content_version is None
+                    or active.get("built_from") != self._content_version
+                    or active.get("version") == self.version):
+                # Nothing new, or published for documents this worker has not rescanned yet
+                return False
+            return self._follow(active["version"])
+
+    def _follow(self, version: str) -> bool:
+        with self._swap_lock:
+            if any(old.version == version for old in self.history):
+                self._roll_back(version)
+                return True
+        index = self.index_store.load(version)
+        if index is None:
+            logger.warning("Published version %s is gone; keeping %s", version, self.version)
+            return False
+        self._swap(self.build_retriever(index))
+        logger.info("Knowledge base switched to published version %s", version)
+        return True
+
+    def _swap(self, retriever) -> float:
+        with self._swap_lock:
+            started = time.perf_counter()
+            if self.retriever is not None:
+                self.history.append(self.retriever)
+            # A version coming back (a reload after a rollback) is served, not kept twice
+            self.history = [old for old in self.history if old.version != retriever.version]
+            self.retriever = retriever
+            swap_seconds = time.perf_counter() - started
+            while len(self.history) > self.keep_versions:
+                self._discard(self.history.pop(0))
+        return swap_seconds
+
+    def rollback(self, version: Optional[str] = None) -> str:
+        """Swap back to the previous version, or to a specific kept version, on every worker"""
+        with self._swap_lock:
+            target = self._roll_back(version)
+        self.index_store.publish(target, self._content_version)
+        return target
+
+    def _roll_back(self, version: Optional[str]) -> str:
+        if not self.history:
+            raise ValueError("No previous knowledge base version to roll back to")
+        if version is None:
+            target = self.history.pop()
+        else:
+            matches = [old for old in self.history if old.version == version]
+            if not matches:
+                raise ValueError(f"Unknown knowledge base version: {version}")
+            target = matches[-1]
+            self.history.remove(target)
+        self.history.append(self.retriever)
+        self.retriever = target
+        logger.info("Knowledge base rolled back to %s", target.version)
+        return target.version
+
+    def _discard(self, retriever):
+        if retriever.version in self._held_versions():
+            return
+        # Other workers may still serve this version; the store only deletes unleased ones
+        self.index_store.release(retriever.version)
+
+    def _held_versions(self) -> set:
+        return {old.version for old in self.history} | ({self.version} if self.retriever else set())
+
+    def status(self) -> dict:
+        return {
+            "version": self.version,
+            "previous_versions": [old.version for old in reversed(self.history)],
+            "published": self.index_store.active(),
+            "last_ingestion": self.last_report,
+            "watching": self._watcher is not None and self._watcher.is_alive(),
+        }
+
+    def start_watching(self, interval: float):
+        """Poll the directory and the published version, and hot-reload on changes"""
+        if interval <= 0 or self._watcher is not None:
+            return
+
+        def watch():
+            while not self._stop.wait(interval):
+                try:
+                    self.index_store.renew(self._held_versions())
+                    self.reload()
+                    self.follow()
+                except Exception:
+                    logger.exception("Knowledge base reload failed; keeping version %s", self.version)
+
+        self._watcher = threading.Thread(target=watch, name="kb-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
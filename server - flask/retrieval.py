@@ -0,0 +1,142 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Iterable, List, Optional
+
+from langchain_core.documents import Document
+
+import telemetry
+from caching import LRUCache, normalize_query
+from vector_index import MappedVectorIndex
+
+# \w misses Indic vowel signs and viramas, which would split every word apart
+TOKEN_PATTERN = re.compile(r"[\w\u0900-\u0dff]+")
+# Acronyms, scheme codes and numbers: AWD, SRI, FPO, PM-KISAN, 2024, 10.5. At least two
+# characters with a digit or two capitals, so "I" and "A" do not count
+LEXICAL_TERM = re.compile(
+    r"^(?=.{2})(?=.*\d|(?:[^A-Z]*[A-Z]){2})(?:[A-Z][A-Z0-9]*(?:[-/][A-Z0-9]+)*|\d+(?:[.,]\d+)*%?)$"
+)
+
+STOPWORDS = {
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'does', 'for',
+    'from', 'how', 'i', 'in', 'is', 'it', 'me', 'my', 'of', 'on', 'or', 'the',
+    'this', 'to', 'what', 'which', 'who', 'why', 'with', 'you', 'your'
+}
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def is_lexical_query(query: str, vocabulary=None) -> bool:
+    """True when the query is only acronyms, scheme codes or numbers.
+
+    With a ``vocabulary`` (e.g. ``BM25Index.idf``) every term must also
+    occur in the corpus, so capitalised chat like "OK" or "HELP" still gets
+    semantic search.
+    """
+    terms = [term.strip(',;:?!') for term in query.strip().strip('"\'?!.').split()]
+    if not terms or not all(LEXICAL_TERM.match(term) for term in terms):
+        return False
+    if vocabulary is None:
+        return True
+    tokens = [token for term in terms for token in tokenize(term)]
+    return bool(tokens) and all(token in vocabulary for token in tokens)
+
+
+class BM25Index:
+    """Okapi BM25 over an in-memory inverted index"""
+
+    def __init__(self, texts: Iterable[str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            term_counts = Counter(tokenize(text))
+            self.doc_lengths.append(sum(term_counts.values()))
+            for term, count in term_counts.items():
+                self.postings[term].append((doc_id, count))
+
+        doc_count = len(self.doc_lengths)
+        self.avg_length = (sum(self.doc_lengths) / doc_count) if doc_count else 0.0
+        self.idf = {
+            term: math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def search(self, query: str, k: int) -> List[int]:
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for doc_id, count in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / self.avg_length)
+                scores[doc_id] += idf * count * (self.k1 + 1) / (count + norm)
+        return sorted(scores, key=scores.get, reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[int]:
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] += 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class HybridRetriever:
+    """BM25 and vector search over the same chunks, fused with reciprocal-rank fusion.
+
+    Queries made only of acronyms or numbers are answered from the lexical
+    index alone, which skips the embedding call entirely. Query embeddings and
+    top-k chunk ids are kept in LRU caches keyed by the index version, so a
+    rebuilt index never serves results computed against the old one. Chunk
+    texts and vectors stay in the memory-mapped ``index``, shared by workers.
+    Pass a ``SharedCache`` as ``embedding_cache`` to share query embeddings
+    between workers too.
+    """
+
+    def __init__(self, index: MappedVectorIndex, embeddings, k: int = 6, fetch_k: int = 20,
+                 cache_size: int = 1024, embedding_cache=None):
+        self.index = index
+        self.k = k
+        self.fetch_k = fetch_k
+        self.embeddings = embeddings
+        self.version = index.version
+        self.embedding_cache = embedding_cache if embedding_cache is not None else LRUCache(cache_size)
+        self.result_cache = LRUCache(cache_size)
+        self.lexical_index = BM25Index(index.texts())
+
+    def invoke(self, query: str, vector_query: Optional[str] = None) -> List[Document]:
+        """Retrieve chunks for ``query``; ``vector_query`` may add semantic context"""
+        vector_query = vector_query or query
+        lexical_only = is_lexical_query(query, self.lexical_index.idf)
+        cache_key = (self.version, normalize_query(query), normalize_query(vector_query), lexical_only)
+        with telemetry.span("retrieval", lexical_only=lexical_only, index_version=self.version) as active:
+            chunk_ids = self.result_cache.get(cache_key)
+            telemetry.record_cache("retrieval", chunk_ids is not None)
+            if chunk_ids is None:
+                chunk_ids = self._rank(query, vector_query, lexical_only)
+                self.result_cache.put(cache_key, chunk_ids)
+            active.set(results=len(chunk_ids))
+        return [self.index.document(doc_id) for doc_id in chunk_ids]
+
+    def _rank(self, query: str, vector_query: str, lexical_only: bool) -> List[int]:
+        lexical_ranking = self.lexical_index.search(query, self.fetch_k)
+        if lexical_ranking and lexical_only:
+            return lexical_ranking[:self.k]
+
+        vector_ranking = self.index.search(self._embed_query(vector_query), self.fetch_k)
+        return reciprocal_rank_fusion([lexical_ranking, vector_ranking])[:self.k]
+
+    def _embed_query(self, text: str) -> List[float]:
+        cache_key = (self.version, normalize_query(text))
+        vector = self.embedding_cache.get(cache_key)
+        telemetry.record_cache("query_embedding", vector is not None)
+        if vector is None:
+            with telemetry.span("embedding"):
+                vector = self.embeddings.embed_query(text)
+            self.embedding_cache.put(cache_key, vector)
+        return vector
+
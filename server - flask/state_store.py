@@ -0,0 +1,467 @@
+"""Shared state for conversation history and caches.
+
+Every store keeps JSON-serialisable values under string keys, with an
+optional TTL in seconds. ``get_many`` and ``set_many`` are the primitives, so
+a request can load everything it needs in one round trip and save it in
+another. Lists have their own primitives: ``append`` adds items and trims to
+a maximum length in one atomic step, so concurrent writers (conversation
+turns from several workers) never overwrite each other. Pick a store with
+``create_state_store(url)``:
+
+- ``memory://`` keeps state in this process (one worker, development)
+- ``sqlite:///state.db`` (or ``sqlite:////abs/state.db``) shares state
+  between workers on one host
+- ``redis://[:password@]host:port/db`` shares state between hosts, using
+  Redis or anything that speaks its protocol
+"""
+import hashlib
+import json
+import logging
+import select
+import socket
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import unquote, urlparse
+
+import telemetry
+from caching import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class StateStoreError(RuntimeError):
+    """Raised when a remote store rejects a command"""
+
+
+# What a store raises when it is unreachable or misbehaving
+STORE_ERRORS = (OSError, sqlite3.Error, StateStoreError)
+
+
+class StateStore(ABC):
+    @abstractmethod
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Values for the keys that exist and have not expired"""
+
+    @abstractmethod
+    def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        """Write every item, each expiring after ``ttl`` seconds if given"""
+
+    @abstractmethod
+    def delete(self, *keys: str):
+        """Remove values and lists alike"""
+
+    @abstractmethod
+    def get_lists(self, keys: Iterable[str]) -> Dict[str, List[Any]]:
+        """Items of the lists that exist and have not expired, oldest first"""
+
+    @abstractmethod
+    def append(self, key: str, items: List[Any], max_length: int, ttl: Optional[float] = None):
+        """Append to the list at ``key``, keep its newest ``max_length`` items and reset its TTL"""
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.get_many([key]).get(key, default)
+
+    def get_list(self, key: str) -> List[Any]:
+        return self.get_lists([key]).get(key, [])
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        self.set_many({key: value}, ttl)
+
+    def close(self):
+        pass
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class InMemoryStateStore(StateStore):
+    """Process-local store; each worker sees only its own state"""
+
+    def __init__(self, max_entries: int = 100000):
+        self.max_entries = max_entries
+        # Values are kept serialised so callers never share mutable objects
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lists: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._data.get(key)
+                if entry is None:
+                    continue
+                value, expires_at = entry
+                if expires_at is not None and expires_at <= now:
+                    del self._data[key]
+                    continue
+                found[key] = value
+        return {key: json.loads(value) for key, value in found.items()}
+
+    def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        encoded = {key: _dumps(value) for key, value in items.items()}
+        with self._lock:
+            for key, value in encoded.items():
+                self._data[key] = (value, expires_at)
+                self._data.move_to_end(key)
+            if len(self._data) > self.max_entries:
+                self._evict_locked()
+
+    def _evict_locked(self):
+        now = time.time()
+        for entries in (self._data, self._lists):
+            for key in [key for key, (_, expires_at) in entries.items() if expires_at is not None and expires_at <= now]:
+                del entries[key]
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+                self._lists.pop(key, None)
+
+    def get_lists(self, keys: Iterable[str]) -> Dict[str, List[Any]]:
+        now = time.time()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._lists.get(key)
+                if entry is None:
+                    continue
+                items, expires_at = entry
+                if expires_at is not None and expires_at <= now:
+                    del self._lists[key]
+                    continue
+                found[key] = list(items)
+        return {key: [json.loads(item) for item in items] for key, items in found.items()}
+
+    def append(self, key: str, items: List[Any], max_length: int, ttl: Optional[float] = None):
+        expires_at = time.time() + ttl if ttl else None
+        encoded = [_dumps(item) for item in items]
+        with self._lock:
+            existing, previous_expiry = self._lists.pop(key, ([], None))
+            if previous_expiry is not None and previous_expiry <= time.time():
+                existing = []
+            self._lists[key] = ((existing + encoded)[-max_length:], expires_at)
+            if len(self._lists) > self.max_entries:
+                self._evict_locked()
+
+
+class SQLiteStateStore(StateStore):
+    """Single-file store shared by every worker on the host (WAL mode)"""
+
+    PURGE_EVERY = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS state_expires_at ON state (expires_at)")
+            # One row per list item, so appends never rewrite what other workers wrote
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS state_list (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "key TEXT NOT NULL, value TEXT NOT NULL, expires_at REAL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS state_list_key ON state_list (key, id)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        rows = self._connection().execute(
+            f"SELECT key, value FROM state WHERE key IN ({placeholders}) AND (expires_at IS NULL OR expires_at > ?)",
+            (*keys, time.time()),
+        ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        if not items:
+            return
+        expires_at = time.time() + ttl if ttl else None
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                [(key, _dumps(value), expires_at) for key, value in items.items()],
+            )
+            self._purge_sometimes(connection)
+
+    def _purge_sometimes(self, connection: sqlite3.Connection):
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            connection.execute("DELETE FROM state WHERE expires_at <= ?", (time.time(),))
+            connection.execute("DELETE FROM state_list WHERE expires_at <= ?", (time.time(),))
+
+    def delete(self, *keys: str):
+        if keys:
+            connection = self._connection()
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany("DELETE FROM state WHERE key = ?", [(key,) for key in keys])
+                connection.executemany("DELETE FROM state_list WHERE key = ?", [(key,) for key in keys])
+
+    def get_lists(self, keys: Iterable[str]) -> Dict[str, List[Any]]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        rows = self._connection().execute(
+            f"SELECT key, value FROM state_list WHERE key IN ({placeholders}) "
+            "AND (expires_at IS NULL OR expires_at > ?) ORDER BY key, id",
+            (*keys, time.time()),
+        ).fetchall()
+        found: Dict[str, List[Any]] = {}
+        for key, value in rows:
+            found.setdefault(key, []).append(json.loads(value))
+        return found
+
+    def append(self, key: str, items: List[Any], max_length: int, ttl: Optional[float] = None):
+        if not items:
+            return
+        now = time.time()
+        expires_at = now + ttl if ttl else None
+        connection = self._connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute("DELETE FROM state_list WHERE key = ? AND expires_at <= ?", (key, now))
+            connection.executemany(
+                "INSERT INTO state_list (key, value, expires_at) VALUES (?, ?, ?)",
+                [(key, _dumps(item), expires_at) for item in items],
+            )
+            connection.execute("UPDATE state_list SET expires_at = ? WHERE key = ?", (expires_at, key))
+            connection.execute(
+                "DELETE FROM state_list WHERE key = ? AND id <= "
+                "(SELECT id FROM state_list WHERE key = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (key, key, max_length),
+            )
+            self._purge_sometimes(connection)
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class RedisStateStore(StateStore):
+    """Minimal RESP2 client: MGET for reads, pipelined SET ... PX for writes,
+    RPUSH + LTRIM + PEXPIRE for list appends.
+
+    Speaks only the handful of commands it needs, so it works against Redis,
+    compatible servers, or the offline stand-in in ``benchmarks.resp_server``.
+    Each thread keeps its own connection.
+    """
+
+    def __init__(self, url: str, timeout: float = 2.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.strip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        connection = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._local.socket = connection
+        self._local.reader = connection.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", str(self.db)))
+        if setup:
+            try:
+                self._roundtrip(setup)
+            except Exception:
+                self.close()
+                raise
+
+    def _execute(self, commands: List[tuple], retry: bool = True) -> list:
+        """Send commands in one write and read one reply each.
+
+        A connection the server closed while idle is replaced before sending.
+        A failure mid-request reconnects and resends once only with ``retry``:
+        appends turn it off, since the server may have run them already.
+        """
+        for attempt in (1, 2):
+            if getattr(self._local, "socket", None) is not None and self._stale():
+                self.close()
+            if getattr(self._local, "socket", None) is None:
+                self._connect()
+            try:
+                return self._roundtrip(commands)
+            except OSError:
+                self.close()
+                if attempt == 2 or not retry:
+                    raise
+
+    def _stale(self) -> bool:
+        # Nothing is outstanding between requests, so readable means EOF or a reset
+        try:
+            readable, _, _ = select.select([self._local.socket], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _roundtrip(self, commands: List[tuple]) -> list:
+        self._local.socket.sendall(b"".join(self._encode(command) for command in commands))
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, StateStoreError):
+                raise reply
+        return replies
+
+    @staticmethod
+    def _encode(command: tuple) -> bytes:
+        parts = [b"*%d\r\n" % len(command)]
+        for argument in command:
+            data = argument if isinstance(argument, bytes) else str(argument).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("State store closed the connection")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            return StateStoreError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return self._local.reader.read(length + 2)[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read_reply() for _ in range(length)]
+        raise StateStoreError(f"Unexpected reply from state store: {line!r}")
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        values = self._execute([("MGET", *keys)])[0]
+        return {key: json.loads(value) for key, value in zip(keys, values) if value is not None}
+
+    def set_many(self, items: Dict[str, Any], ttl: Optional[float] = None):
+        if not items:
+            return
+        expiry = ("PX", int(ttl * 1000)) if ttl else ()
+        self._execute([("SET", key, _dumps(value), *expiry) for key, value in items.items()])
+
+    def delete(self, *keys: str):
+        if keys:
+            self._execute([("DEL", *keys)])
+
+    def get_lists(self, keys: Iterable[str]) -> Dict[str, List[Any]]:
+        keys = list(keys)
+        if not keys:
+            return {}
+        replies = self._execute([("LRANGE", key, 0, -1) for key in keys])
+        return {key: [json.loads(item) for item in items] for key, items in zip(keys, replies) if items}
+
+    def append(self, key: str, items: List[Any], max_length: int, ttl: Optional[float] = None):
+        if not items:
+            return
+        # Each command is atomic on the server; interleaved appends all survive the trim
+        commands = [("RPUSH", key, *(_dumps(item) for item in items)), ("LTRIM", key, -max_length, -1)]
+        if ttl:
+            commands.append(("PEXPIRE", key, int(ttl * 1000)))
+        # RPUSH is not idempotent: a resend after a lost reply would store the turn twice
+        self._execute(commands, retry=False)
+
+    def close(self):
+        connection = getattr(self._local, "socket", None)
+        if connection is not None:
+            try:
+                connection.close()
+            finally:
+                self._local.socket = None
+
+
+def create_state_store(url: str = "memory://") -> StateStore:
+    scheme = url.split("://", 1)[0].lower()
+    if scheme == "memory":
+        return InMemoryStateStore()
+    if scheme == "sqlite" and ":///" in url:
+        # sqlite:///state.db is relative, sqlite:////var/lib/state.db absolute
+        return SQLiteStateStore(url.split(":///", 1)[1])
+    if scheme == "redis":
+        return RedisStateStore(url)
+    raise ValueError(f"Unknown state store: {url}")
+
+
+class SharedCache:
+    """``LRUCache``-compatible cache over a state store namespace.
+
+    A small local LRU sits in front, so repeated keys in one worker skip the
+    round trip; misses fall through to the shared store, where entries written
+    by any worker are visible until their TTL runs out. When the store is
+    down the cache degrades to the local LRU instead of failing the caller.
+    """
+
+    def __init__(self, store: StateStore, namespace: str, ttl: Optional[float] = None, local_size: int = 256):
+        self.store = store
+        self.namespace = namespace
+        self.ttl = ttl
+        self.local = LRUCache(local_size)
+
+    def _key(self, key) -> str:
+        digest = hashlib.sha1(_dumps(key).encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{digest}"
+
+    def get(self, key, default: Optional[Any] = None) -> Any:
+        value = self.local.get(key)
+        if value is None:
+            try:
+                value = self.store.get(self._key(key))
+            except STORE_ERRORS as e:
+                self._store_failed("get", e)
+                return default
+            if value is None:
+                return default
+            self.local.put(key, value)
+        return value
+
+    def put(self, key, value: Any):
+        self.local.put(key, value)
+        try:
+            self.store.set(self._key(key), value, self.ttl)
+        except STORE_ERRORS as e:
+            self._store_failed("put", e)
+
+    def _store_failed(self, operation: str, error: BaseException):
+        telemetry.STATE_STORE_ERRORS.labels(f"{self.namespace}.{operation}").inc()
+        logger.warning("State store %s failed for %s, using the local cache: %s", operation, self.namespace, error)
+
+    def clear(self):
+        self.local.clear()
@@ -0,0 +1,384 @@
+"""Per-stage tracing and Prometheus metrics for the chatbot.
+
+``span(name)`` times a block of work, nests under whatever span is current in
+the calling context, feeds the stage latency histogram and error counter, and
+hands the finished span to the configured exporters (JSON-lines file and/or
+an HTTP collector, see ``configure_exporters``).
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Dict, Optional
+
+import requests
+from langchain_core.callbacks import BaseCallbackHandler
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    REGISTRY,
+    generate_latest,
+)
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+STAGE_LATENCY = Histogram(
+    "chatbot_stage_latency_seconds", "Latency of each chatbot stage",
+    ["stage", "language"], buckets=LATENCY_BUCKETS,
+)
+STAGE_ERRORS = Counter(
+    "chatbot_stage_errors_total", "Errors raised or swallowed by each chatbot stage",
+    ["stage", "language"],
+)
+REQUEST_LATENCY = Histogram(
+    "chatbot_request_latency_seconds", "End-to-end HTTP request latency",
+    ["endpoint", "status"], buckets=LATENCY_BUCKETS,
+)
+IN_FLIGHT = Gauge(
+    "chatbot_in_flight_requests", "Requests currently being served",
+    ["endpoint"], multiprocess_mode="livesum",
+)
+CACHE_REQUESTS = Counter(
+    "chatbot_cache_requests_total", "Cache lookups by result",
+    ["cache", "result"],
+)
+CACHE_HIT_RATIO = Gauge(
+    "chatbot_cache_hit_ratio", "Hit ratio of each cache since process start",
+    ["cache"], multiprocess_mode="liveall",
+)
+LLM_TOKENS = Counter(
+    "chatbot_llm_tokens_total", "Tokens sent to and received from the LLM",
+    ["direction", "language"],
+)
+ADMISSION_WAIT = Histogram(
+    "chatbot_admission_wait_seconds", "Time /chat requests spend waiting for an agent slot",
+    ["priority"], buckets=LATENCY_BUCKETS,
+)
+ADMISSION_SHED = Counter(
+    "chatbot_admission_shed_total", "Requests turned away by admission control",
+    ["reason", "priority"],
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "chatbot_admission_queue_depth", "Requests waiting for an agent slot",
+    multiprocess_mode="livesum",
+)
+ADMISSION_LIMIT = Gauge(
+    "chatbot_admission_concurrency_limit", "Current adaptive limit on concurrent agent runs",
+    multiprocess_mode="liveall",
+)
+UPSTREAM_RATE_LIMITED = Counter(
+    "chatbot_upstream_rate_limited_total", "Agent runs that failed with an upstream 429",
+)
+STATE_STORE_ERRORS = Counter(
+    "chatbot_state_store_errors_total", "Shared state store calls that failed and fell back",
+    ["operation"],
+)
+EMBEDDING_BATCH_SIZE = Histogram(
+    "chatbot_embedding_batch_size", "Queries embedded per batched upstream call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+EMBEDDING_QUEUE_DELAY = Histogram(
+    "chatbot_embedding_queue_delay_seconds", "Time a query waits for its embedding batch to start",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+_language: contextvars.ContextVar = contextvars.ContextVar("language", default="unknown")
+_cache_totals: Dict[str, list] = {}
+_cache_lock = threading.Lock()
+_exporters = []
+
+
+class Span:
+    def __init__(self, name: str, parent: Optional["Span"] = None, attributes: Optional[dict] = None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.language = parent.language if parent else _language.get()
+        self.error = None
+        self.start_time = time.time()
+        self._started = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self, error: Optional[BaseException] = None):
+        if self.duration is not None:
+            return
+        self.duration = time.perf_counter() - self._started
+        language = self.language
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+            STAGE_ERRORS.labels(self.name, language).inc()
+        STAGE_LATENCY.labels(self.name, language).observe(self.duration)
+        if _exporters:
+            record = self.to_dict()
+            record["language"] = language
+            for exporter in _exporters:
+                exporter.submit(record)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_time,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+            "status": "error" if self.error else "ok",
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a stage as a child of the current span"""
+    active = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        active.finish(e)
+        raise
+    else:
+        active.finish()
+    finally:
+        _current_span.reset(token)
+
+
+def traced(name: str):
+    """Decorator form of ``span``"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def set_language(language: str):
+    """Label spans and metrics in this request with the detected language.
+
+    ``language`` becomes a Prometheus label, so it must come from a fixed set.
+    """
+    _language.set(language)
+    # Ancestors started before detection; relabel them so the whole trace agrees
+    active = _current_span.get()
+    while active is not None:
+        active.language = language
+        active = active.parent
+
+
+def record_error(stage: str, error: BaseException):
+    """Count an exception that was handled without propagating"""
+    active = _current_span.get()
+    if active is not None and active.error is None:
+        active.error = f"{type(error).__name__}: {error}"
+    STAGE_ERRORS.labels(stage, _language.get()).inc()
+    logger.warning("%s failed: %s", stage, error, exc_info=error)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+    with _cache_lock:
+        totals = _cache_totals.setdefault(cache, [0, 0])
+        totals[0 if hit else 1] += 1
+        ratio = totals[0] / (totals[0] + totals[1])
+    CACHE_HIT_RATIO.labels(cache).set(ratio)
+
+
+def record_llm_tokens(input_tokens: int, output_tokens: int):
+    language = _language.get()
+    if input_tokens:
+        LLM_TOKENS.labels("input", language).inc(input_tokens)
+    if output_tokens:
+        LLM_TOKENS.labels("output", language).inc(output_tokens)
+
+
+class LLMTracingCallback(BaseCallbackHandler):
+    """Emits an ``llm`` span with token counts for every model call"""
+
+    def __init__(self):
+        self._spans: Dict[Any, Span] = {}
+        self._lock = threading.Lock()
+
+    def _start(self, run_id, model: Optional[str]):
+        active = Span("llm", _current_span.get(), {"model": model} if model else None)
+        with self._lock:
+            self._spans[run_id] = active
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, (serialized or {}).get("name"))
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, (serialized or {}).get("name"))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self._lock:
+            active = self._spans.pop(run_id, None)
+        if active is None:
+            return
+        input_tokens, output_tokens = _token_usage(response)
+        active.set(input_tokens=input_tokens, output_tokens=output_tokens)
+        record_llm_tokens(input_tokens, output_tokens)
+        active.finish()
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self._lock:
+            active = self._spans.pop(run_id, None)
+        if active is not None:
+            active.finish(error)
+
+
+def _token_usage(response) -> tuple:
+    input_tokens = output_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            input_tokens += usage.get("input_tokens", 0)
+            output_tokens += usage.get("output_tokens", 0)
+    if not (input_tokens or output_tokens):
+        usage = (response.llm_output or {}).get("token_usage") or (response.llm_output or {}).get("usage_metadata") or {}
+        input_tokens = usage.get("input_tokens", usage.get("prompt_tokens", 0))
+        output_tokens = usage.get("output_tokens", usage.get("completion_tokens", 0))
+    return input_tokens, output_tokens
+
+
+llm_callback = LLMTracingCallback()
+
+
+class _BackgroundExporter:
+    """Ships finished spans off the request path in batches"""
+
+    def __init__(self, sink, batch_size: int = 100, flush_interval: float = 1.0, max_queue: int = 10000):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: dict):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            pass  # Dropping spans is better than blocking requests
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.sink(batch)
+            except Exception:
+                logger.exception("Span export failed; dropped %d spans", len(batch))
+
+
+def _jsonl_sink(path: str):
+    lock = threading.Lock()
+
+    def write(batch):
+        with lock, open(path, "a", encoding="utf-8") as handle:
+            for record in batch:
+                handle.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return write
+
+
+def _collector_sink(url: str):
+    def post(batch):
+        requests.post(url, json={"spans": batch}, timeout=5)
+    return post
+
+
+def configure_exporters(trace_file: Optional[str] = None, collector_url: Optional[str] = None):
+    """Export spans to a JSON-lines file and/or POST them to a local collector"""
+    if trace_file:
+        _exporters.append(_BackgroundExporter(_jsonl_sink(trace_file)))
+    if collector_url:
+        _exporters.append(_BackgroundExporter(_collector_sink(collector_url)))
+
+
+def metrics_payload() -> tuple:
+    """Prometheus exposition for this process, or all workers in multiprocess mode"""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class TelemetryMiddleware:
+    """ASGI middleware: root span, in-flight gauge and request latency per endpoint.
+
+    The request is only counted as finished once the last body chunk is sent,
+    so streamed ``/speak`` audio is measured end to end.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._endpoints = None
+
+    def _endpoint(self, scope) -> str:
+        if self._endpoints is None:
+            routes = getattr(scope.get("app"), "routes", [])
+            self._endpoints = {getattr(route, "path", None) for route in routes}
+        path = scope.get("path", "")
+        return path if path in self._endpoints else "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+        status = {"code": 500}
+        # Handlers measure queueing deadlines from here, via ``request.state.arrived_at``
+        scope.setdefault("state", {})["arrived_at"] = time.monotonic()
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        IN_FLIGHT.labels(endpoint).inc()
+        started = time.perf_counter()
+        try:
+            with span("request", endpoint=endpoint, method=scope.get("method")) as root:
+                try:
+                    await self.app(scope, receive, send_with_status)
+                finally:
+                    root.set(status=status["code"])
+        finally:
+            IN_FLIGHT.labels(endpoint).dec()
+            REQUEST_LATENCY.labels(endpoint, str(status["code"])).observe(time.perf_counter() - started)
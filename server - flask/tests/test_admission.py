@@ -0,0 +1,199 @@
+import asyncio
+import time
+
+import pytest
+
+from admission import AdmissionController, Overloaded, is_rate_limit_error
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+async def hold(controller, gate, order, name, session_id=None, priority=1, deadline=None):
+    async with controller.admit(session_id, priority, deadline):
+        order.append(name)
+        await gate.wait()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_waiters_are_dispatched_in_priority_order():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, per_session=0)
+        gate, order = asyncio.Event(), []
+        tasks = [asyncio.create_task(hold(controller, gate, order, "running"))]
+        await settle()
+        for name, priority in (("background", 2), ("normal", 1), ("urgent", 0), ("normal-2", 1)):
+            tasks.append(asyncio.create_task(hold(controller, gate, order, name, priority=priority)))
+        await settle()
+        assert controller.status()["queued"] == 4
+        gate.set()
+        await asyncio.gather(*tasks)
+        return order, controller.status()
+
+    order, status = run(scenario())
+    assert order == ["running", "urgent", "normal", "normal-2", "background"]
+    assert status["in_flight"] == 0 and status["queued"] == 0
+
+
+def test_full_queue_displaces_less_important_waiters():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, queue_size=1, per_session=0)
+        gate, order = asyncio.Event(), []
+        running = asyncio.create_task(hold(controller, gate, order, "running"))
+        await settle()
+        background = asyncio.create_task(hold(controller, gate, order, "background", priority=2))
+        await settle()
+        # Equal or lower priority cannot push anyone out
+        with pytest.raises(Overloaded) as full:
+            await hold(controller, gate, order, "also-background", priority=2)
+        urgent = asyncio.create_task(hold(controller, gate, order, "urgent", priority=0))
+        await settle()
+        with pytest.raises(Overloaded) as displaced:
+            await background
+        gate.set()
+        await asyncio.gather(running, urgent)
+        return order, full.value, displaced.value
+
+    order, full, displaced = run(scenario())
+    assert full.reason == "queue_full"
+    assert displaced.reason == "displaced" and displaced.retry_after >= 1
+    assert order == ["running", "urgent"]
+
+
+def test_requests_are_shed_at_their_deadline():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, per_session=0, service_estimate=0.01)
+        gate, order = asyncio.Event(), []
+        running = asyncio.create_task(hold(controller, gate, order, "running"))
+        await settle()
+        # Arrived long enough ago that its queueing budget is already spent
+        with pytest.raises(Overloaded) as late:
+            await hold(controller, gate, order, "late", deadline=time.monotonic() - 0.1)
+        started = time.monotonic()
+        with pytest.raises(Overloaded) as waited:
+            await hold(controller, gate, order, "waiting", deadline=started + 0.05)
+        waited_for = time.monotonic() - started
+        status = controller.status()
+        gate.set()
+        await running
+        return late.value, waited.value, waited_for, status
+
+    late, waited, waited_for, status = run(scenario())
+    assert late.reason == "deadline" and waited.reason == "deadline"
+    assert 0.04 <= waited_for < 0.5
+    assert status["queued"] == 0
+
+
+def test_expected_wait_sheds_before_the_first_run_finishes():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, per_session=0, service_estimate=5.0)
+        gate, order = asyncio.Event(), []
+        running = asyncio.create_task(hold(controller, gate, order, "running"))
+        await settle()
+        started = time.monotonic()
+        with pytest.raises(Overloaded) as shed:
+            await hold(controller, gate, order, "hopeless", deadline=started + 1.0)
+        elapsed = time.monotonic() - started
+        gate.set()
+        await running
+        return shed.value, elapsed
+
+    shed, elapsed = run(scenario())
+    assert shed.reason == "deadline" and shed.retry_after >= 5
+    assert elapsed < 0.1
+
+
+def test_one_turn_per_session_at_a_time():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=4, per_session=1)
+        gate, order = asyncio.Event(), []
+        tasks = [
+            asyncio.create_task(hold(controller, gate, order, "s1-first", session_id="s1")),
+            asyncio.create_task(hold(controller, gate, order, "s1-second", session_id="s1")),
+            asyncio.create_task(hold(controller, gate, order, "s2", session_id="s2")),
+        ]
+        await settle()
+        admitted = list(order)
+        gate.set()
+        await asyncio.gather(*tasks)
+        return admitted, order
+
+    admitted, order = run(scenario())
+    assert admitted == ["s1-first", "s2"]
+    assert order[-1] == "s1-second"
+
+
+def test_cancelled_waiters_leave_the_queue():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, per_session=0)
+        gate, order = asyncio.Event(), []
+        running = asyncio.create_task(hold(controller, gate, order, "running"))
+        await settle()
+        waiting = asyncio.create_task(hold(controller, gate, order, "disconnected"))
+        await settle()
+        waiting.cancel()
+        await settle()
+        queued = controller.status()["queued"]
+        gate.set()
+        await running
+        async with controller.admit():
+            pass
+        return queued, order, controller.status()
+
+    queued, order, status = run(scenario())
+    assert queued == 0
+    assert order == ["running"]
+    assert status["in_flight"] == 0
+
+
+def test_limit_halves_on_rate_limits_and_grows_back():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=8, min_concurrency=2, cooldown=60)
+        limits = []
+        with pytest.raises(RateLimited):
+            async with controller.admit():
+                raise RateLimited("429 Resource has been exhausted")
+        limits.append(controller.limit)
+        # Calls already in flight report the same overload; only one backoff per cooldown
+        controller.record_rate_limit()
+        limits.append(controller.limit)
+        controller._last_backoff = 0
+        controller.record_rate_limit()
+        controller._last_backoff = 0
+        controller.record_rate_limit()
+        limits.append(controller.limit)
+        for _ in range(40):
+            async with controller.admit():
+                pass
+        limits.append(controller.limit)
+        return limits
+
+    assert run(scenario()) == [4.0, 4.0, 2.0, 8.0]
+
+
+def test_rate_limit_errors_are_recognised():
+    assert is_rate_limit_error(RateLimited())
+    assert is_rate_limit_error(RuntimeError("429 Quota exceeded for gemini-1.5-flash"))
+    wrapped = RuntimeError("agent failed")
+    wrapped.__cause__ = RateLimited()
+    assert is_rate_limit_error(wrapped)
+    assert is_rate_limit_error(RuntimeError("RESOURCE_EXHAUSTED: try again later"))
+    assert not is_rate_limit_error(ValueError("bad input"))
+
+
+@pytest.mark.parametrize("message", [
+    "The input token count (14290) exceeds the maximum number of tokens allowed (8192).",
+    "Could not determine quota_project_id from the credentials",
+    "Request payload size exceeds the limit: 4294967 bytes",
+])
+def test_unrelated_errors_are_not_rate_limits(message):
+    assert not is_rate_limit_error(ValueError(message))
@@ -0,0 +1,57 @@
+from context_budget import DEFAULT_SHARES, RequestBudget, _merge_overlap, count_tokens, deduplicate_chunks
+
+
+def paragraph(label: str, sentences: int = 60) -> str:
+    return " ".join(f"{label} sentence {index} about the NABARD carbon credit scheme." for index in range(sentences))
+
+
+def test_deduplicate_drops_contained_chunks():
+    long = paragraph("alpha")
+    assert deduplicate_chunks([long[:500], long, "  "]) == [long]
+
+
+def test_deduplicate_stitches_overlapping_neighbours():
+    text = paragraph("beta")
+    first, second = text[:1200], text[900:]
+    assert _merge_overlap(first, second) == text
+    assert deduplicate_chunks([second, first]) == [text]
+
+
+def test_deduplicate_keeps_rank_order_of_unrelated_chunks():
+    chunks = [paragraph("gamma", 5), paragraph("delta", 5), paragraph("epsilon", 5)]
+    assert deduplicate_chunks(chunks) == chunks
+
+
+def test_repeated_searches_each_get_room():
+    budget = RequestBudget(8000, DEFAULT_SHARES)
+    limit = budget.limits['retrieval']
+    chunks = [paragraph(f"chunk{index}") for index in range(8)]
+
+    first = budget.fit_chunks(chunks[:6])
+    assert 0 < sum(map(count_tokens, first)) <= limit // 2
+
+    second = budget.fit_chunks(chunks[1:7])
+    assert second
+    assert not set(second) & set(first)
+
+    # The retrieval share is spent, but the floor still lets a third search through
+    assert budget.remaining('retrieval') < 64
+    assert budget.fit_chunks(chunks[5:8])
+
+
+def test_chunks_already_sent_are_skipped():
+    budget = RequestBudget(100000, DEFAULT_SHARES)
+    chunks = [paragraph("zeta", 5), paragraph("eta", 5)]
+    assert budget.fit_chunks(chunks) == chunks
+    assert budget.fit_chunks(chunks) == []
+    assert budget.fit_chunks([chunks[0][:200], paragraph("theta", 5)]) == [paragraph("theta", 5)]
+
+
+def test_truncated_chunks_are_not_treated_as_sent_in_full():
+    budget = RequestBudget(8000, DEFAULT_SHARES)
+    long = paragraph("iota", 400)
+    first = budget.fit_chunks([long])
+    assert first and count_tokens(first[0]) < count_tokens(long)
+    # The cut text is skipped, but the part the model never saw is still available
+    assert budget.fit_chunks([first[0]]) == []
+    assert budget.fit_chunks([long])
@@ -0,0 +1,158 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from embedding_batcher import EmbeddingBatcher
+
+
+class RecordingEmbeddings(Embeddings):
+    """Vector is ``[len(text), call number]``; optionally fails or waits for ``gate``"""
+
+    def __init__(self, fail: bool = False, gate: threading.Event = None):
+        self.fail = fail
+        self.gate = gate
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str], task_type: str = None) -> List[List[float]]:
+        with self.lock:
+            self.batches.append((list(texts), task_type))
+            call = len(self.batches)
+        if self.gate is not None:
+            self.gate.wait(timeout=5)
+        if self.fail:
+            raise RuntimeError("embedding upstream unavailable")
+        return [[float(len(text)), float(call)] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        raise AssertionError("the batcher should only call embed_documents")
+
+
+@pytest.fixture
+def make_batcher():
+    batchers = []
+
+    def make(base, **kwargs):
+        batcher = EmbeddingBatcher(base, **kwargs)
+        batchers.append(batcher)
+        return batcher
+
+    yield make
+    for batcher in batchers:
+        batcher.close()
+
+
+def test_concurrent_queries_share_one_call_and_get_their_own_vectors(make_batcher):
+    base = RecordingEmbeddings()
+    batcher = make_batcher(base, window_ms=200, max_batch=64)
+    texts = [f"query number {index}" + "!" * index for index in range(20)] + ["query number 0"] * 5
+    barrier = threading.Barrier(len(texts))
+
+    def embed(text):
+        barrier.wait()
+        return batcher.embed_query(text)
+
+    with ThreadPoolExecutor(max_workers=len(texts)) as pool:
+        vectors = list(pool.map(embed, texts))
+
+    assert [vector[0] for vector in vectors] == [float(len(text)) for text in texts]
+    assert len(base.batches) < len(texts)
+    # Duplicates are embedded once per batch, and query embeddings keep their task type
+    for batch, task_type in base.batches:
+        assert len(batch) == len(set(batch))
+        assert task_type == "RETRIEVAL_QUERY"
+
+
+def test_batches_are_capped_at_max_batch(make_batcher):
+    base = RecordingEmbeddings()
+    batcher = make_batcher(base, window_ms=200, max_batch=4)
+    with ThreadPoolExecutor(max_workers=10) as pool:
+        list(pool.map(batcher.embed_query, [f"text {index}" for index in range(10)]))
+    assert all(len(batch) <= 4 for batch, _ in base.batches)
+    assert sum(len(batch) for batch, _ in base.batches) == 10
+
+
+def test_errors_reach_every_caller_in_the_batch(make_batcher):
+    batcher = make_batcher(RecordingEmbeddings(fail=True), window_ms=100, max_batch=16)
+
+    def embed(text):
+        try:
+            batcher.embed_query(text)
+        except RuntimeError as e:
+            return str(e)
+        return "no error"
+
+    with ThreadPoolExecutor(max_workers=6) as pool:
+        outcomes = list(pool.map(embed, [f"text {index}" for index in range(6)]))
+    assert outcomes == ["embedding upstream unavailable"] * 6
+
+
+def test_a_failed_batch_does_not_block_later_ones(make_batcher):
+    base = RecordingEmbeddings(fail=True)
+    batcher = make_batcher(base, window_ms=1, max_batch=8, max_concurrent_batches=1)
+    with pytest.raises(RuntimeError):
+        batcher.embed_query("first")
+    base.fail = False
+    assert batcher.embed_query("second")[0] == float(len("second"))
+
+
+def test_documents_bypass_the_batcher(make_batcher):
+    base = RecordingEmbeddings()
+    batcher = make_batcher(base)
+    assert batcher.embed_documents(["a", "bb"]) == [[1.0, 1.0], [2.0, 1.0]]
+    assert base.batches == [(["a", "bb"], None)]
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert condition()
+
+
+def test_queries_after_close_fail_at_once(make_batcher):
+    batcher = make_batcher(RecordingEmbeddings())
+    batcher.close()
+    with pytest.raises(RuntimeError, match="closed"):
+        batcher.embed_query("late")
+
+
+def test_close_fails_queries_still_waiting(make_batcher):
+    gate = threading.Event()
+    base = RecordingEmbeddings(gate=gate)
+    batcher = make_batcher(base, window_ms=1, max_batch=1, max_concurrent_batches=1)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        running = pool.submit(batcher.embed_query, "running")
+        wait_for(lambda: len(base.batches) == 1)
+        # One waits in the collector for the busy slot, the next in the queue
+        waiting = [pool.submit(batcher.embed_query, text) for text in ("second", "third")]
+        time.sleep(0.05)
+        batcher.close()
+        gate.set()
+        assert running.result(timeout=2)[0] == float(len("running"))
+        for future in waiting:
+            with pytest.raises(RuntimeError):
+                future.result(timeout=2)
+    assert len(base.batches) == 1
+
+
+def test_callers_give_up_after_the_timeout(make_batcher):
+    gate = threading.Event()
+    base = RecordingEmbeddings(gate=gate)
+    batcher = make_batcher(base, window_ms=1, max_batch=1, max_concurrent_batches=1, timeout=0.1)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        running = pool.submit(batcher.embed_query, "running")
+        wait_for(lambda: len(base.batches) == 1)
+        queued = pool.submit(batcher.embed_query, "queued")
+        with pytest.raises(TimeoutError):
+            running.result(timeout=2)
+        with pytest.raises(TimeoutError):
+            queued.result(timeout=2)
+    gate.set()
+    # The queued caller cancelled before its batch ran, so it is never embedded
+    assert batcher.embed_query("after")[0] == float(len("after"))
+    assert [batch for batch, _ in base.batches] == [["running"], ["after"]]
@@ -0,0 +1,126 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from ingestion import KnowledgeBase
+from vector_index import MappedIndexStore
+
+
+class HashEmbeddings:
+    """Tiny deterministic vectors, counting documents embedded"""
+
+    def __init__(self):
+        self.embedded = 0
+
+    def embed_documents(self, texts):
+        self.embedded += len(texts)
+        return [[float(len(text)), float(sum(map(ord, text)) % 97), 1.0] for text in texts]
+
+
+def write(directory, name, text):
+    path = os.path.join(directory, name)
+    with open(path, "w", encoding="utf-8") as handle:
+        handle.write(text)
+    # Distinct mtimes even on coarse filesystem clocks
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def worker(tmp_path):
+    """A KnowledgeBase as one server worker would build it, sharing docs and index"""
+    return KnowledgeBase(
+        str(tmp_path / "docs"),
+        HashEmbeddings(),
+        build_retriever=lambda index: SimpleNamespace(version=index.version, index=index),
+        splitter_kwargs={"chunk_size": 200, "chunk_overlap": 0},
+        index_store=MappedIndexStore(str(tmp_path / "index")),
+        workers=1,
+        keep_versions=2,
+    )
+
+
+@pytest.fixture
+def knowledge_base(tmp_path):
+    (tmp_path / "docs").mkdir()
+    write(tmp_path / "docs", "awd.md", "Alternate wetting and drying cuts methane from paddy.")
+    return worker(tmp_path)
+
+
+def test_reload_of_unchanged_chunks_keeps_the_retriever(knowledge_base):
+    knowledge_base.reload()
+    current = knowledge_base.retriever
+    # Touching the file changes the snapshot but not the chunks
+    write(knowledge_base.directory, "awd.md", "Alternate wetting and drying cuts methane from paddy.")
+    report = knowledge_base.reload()
+    assert report["version"] == current.version and report["swap_ms"] == 0
+    assert knowledge_base.reload(force=True)["swap_ms"] == 0
+    assert knowledge_base.retriever is current
+    assert knowledge_base.history == []
+
+
+def test_reload_after_rollback_does_not_duplicate_history(knowledge_base):
+    knowledge_base.reload()
+    first = knowledge_base.version
+    write(knowledge_base.directory, "pm.md", "PM-KISAN pays farmers 6000 rupees a year.")
+    knowledge_base.reload()
+    second = knowledge_base.version
+    assert knowledge_base.rollback() == first
+    knowledge_base.reload(force=True)
+    assert knowledge_base.version == second
+    assert [old.version for old in knowledge_base.history] == [first]
+
+
+def test_pruning_after_a_rollback_keeps_rollback_targets_on_disk(knowledge_base):
+    knowledge_base.keep_versions = 1
+    store = knowledge_base.index_store
+    knowledge_base.reload()
+    first = knowledge_base.version
+    write(knowledge_base.directory, "pm.md", "PM-KISAN pays farmers 6000 rupees a year.")
+    knowledge_base.reload()
+    second = knowledge_base.version
+    knowledge_base.rollback()
+    write(knowledge_base.directory, "fpo.md", "NABARD refinances banks lending to FPOs.")
+    knowledge_base.reload()
+    third = knowledge_base.version
+
+    # The second version fell out of history; the one rolled back to is kept
+    assert [old.version for old in knowledge_base.history] == [first]
+    assert sorted(store.versions()) == sorted([first, third])
+    assert knowledge_base.rollback() == first
+    assert knowledge_base.retriever.index.text(0).startswith("Alternate wetting")
+    assert second not in store.versions()
+
+
+def test_rollback_and_reload_reach_every_worker(knowledge_base, tmp_path):
+    first_worker, second_worker = knowledge_base, worker(tmp_path)
+    for base in (first_worker, second_worker):
+        base.reload()
+    old = first_worker.version
+    write(first_worker.directory, "pm.md", "PM-KISAN pays farmers 6000 rupees a year.")
+    for base in (first_worker, second_worker):
+        base.reload()
+    new = first_worker.version
+
+    assert first_worker.rollback() == old
+    assert second_worker.follow() and second_worker.version == old
+    assert not second_worker.follow()
+    # A worker started after the rollback, or one whose watcher sees a touched
+    # file, keeps serving the rolled back version
+    late_worker = worker(tmp_path)
+    late_worker.reload()
+    write(first_worker.directory, "pm.md", "PM-KISAN pays farmers 6000 rupees a year.")
+    second_worker.reload()
+    assert late_worker.version == second_worker.version == old
+
+    # A forced reload serves the documents as they are again, everywhere
+    first_worker.reload(force=True)
+    assert second_worker.follow() and late_worker.follow()
+    assert {base.version for base in (first_worker, second_worker, late_worker)} == {new}
+
+    # A version published for newer documents waits for this worker's own rescan
+    write(first_worker.directory, "fpo.md", "NABARD refinances banks lending to FPOs.")
+    first_worker.reload()
+    assert not second_worker.follow() and second_worker.version == new
+    second_worker.reload()
+    assert second_worker.version == first_worker.version != new
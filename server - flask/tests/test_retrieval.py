@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+
+from retrieval import BM25Index, HybridRetriever, is_lexical_query, reciprocal_rank_fusion, tokenize
+from vector_index import MappedIndexStore
+
+TEXTS = [
+    "Alternate wetting and drying (AWD) cuts methane from paddy fields by a third.",
+    "PM-KISAN pays eligible farmers 6000 rupees a year in three instalments.",
+    "NABARD refinances cooperative banks that lend to farmer producer organisations.",
+    "Agroforestry earns carbon credits; AWD and SRI earn them in paddy.",
+]
+
+
+class CountingEmbeddings:
+    """Bag-of-words vectors over the test vocabulary, counting calls"""
+
+    def __init__(self):
+        self.vocabulary = sorted({token for text in TEXTS for token in tokenize(text)})
+        self.calls = 0
+
+    def _vector(self, text):
+        tokens = set(tokenize(text))
+        return [1.0 if term in tokens else 0.0 for term in self.vocabulary]
+
+    def embed_query(self, text):
+        self.calls += 1
+        return self._vector(text)
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+
+@pytest.fixture
+def retriever(tmp_path):
+    embeddings = CountingEmbeddings()
+    index = MappedIndexStore(str(tmp_path)).load_or_build(
+        "test", TEXTS, ["kb.txt"] * len(TEXTS),
+        lambda texts: np.array(embeddings.embed_documents(texts), dtype=np.float32),
+    )
+    return HybridRetriever(index, embeddings, k=2)
+
+
+def test_bm25_ranks_rarer_terms_higher():
+    index = BM25Index(TEXTS)
+    assert index.search("AWD paddy", 4)[:2] == [0, 3]
+    assert index.search("PM-KISAN instalments", 4)[0] == 1
+    assert index.search("unknown words only", 4) == []
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    assert reciprocal_rank_fusion([[1, 2, 3], [4, 2, 5]]) == [2, 1, 4, 3, 5]
+    assert reciprocal_rank_fusion([[], [5, 6]]) == [5, 6]
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("AWD", True),
+    ("PM-KISAN", True),
+    ('"FPO"?', True),
+    ("2024", True),
+    ("10.5%", True),
+    ("I", False),
+    ("A", False),
+    ("5", False),
+    ("awd", False),
+    ("What is AWD?", False),
+])
+def test_lexical_terms(query, expected):
+    assert is_lexical_query(query) is expected
+
+
+def test_lexical_queries_must_use_corpus_terms():
+    vocabulary = BM25Index(TEXTS).idf
+    assert is_lexical_query("AWD SRI", vocabulary)
+    assert not is_lexical_query("OK", vocabulary)
+    assert not is_lexical_query("AWD OK", vocabulary)
+
+
+def test_acronym_queries_skip_the_embedding_call(retriever):
+    documents = retriever.invoke("AWD")
+    assert [document.metadata["chunk_id"] for document in documents] == [0, 3]
+    assert retriever.embeddings.calls == 0
+
+    retriever.invoke("OK")
+    assert retriever.embeddings.calls == 1
+
+
+def test_hybrid_results_are_cached_per_query(retriever):
+    first = retriever.invoke("methane from paddy")
+    second = retriever.invoke("  Methane from PADDY ")
+    assert [document.page_content for document in first] == [document.page_content for document in second]
+    assert retriever.embeddings.calls == 1
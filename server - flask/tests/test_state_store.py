@@ -0,0 +1,162 @@
+import threading
+import time
+
+import pytest
+
+from benchmarks.resp_server import RESPServer
+from state_store import InMemoryStateStore, RedisStateStore, SharedCache, StateStoreError, create_state_store
+
+
+@pytest.fixture(scope="module")
+def resp_server():
+    server = RESPServer(port=0)
+    server.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def store(request, tmp_path, resp_server):
+    urls = {
+        "memory": "memory://",
+        "sqlite": f"sqlite:///{tmp_path}/state.db",
+        "redis": f"redis://127.0.0.1:{resp_server.server_address[1]}/0",
+    }
+    resp_server.store.data.clear()
+    store = create_state_store(urls[request.param])
+    yield store
+    store.close()
+
+
+def test_values_round_trip(store):
+    value = {"text": "धान की खेती", "vector": [0.25, -1.5], "nested": {"ok": True}}
+    store.set_many({"a": value, "b": [1, 2, 3]})
+    assert store.get_many(["a", "b", "missing"]) == {"a": value, "b": [1, 2, 3]}
+    store.delete("a")
+    assert store.get("a") is None
+    assert store.get("b") == [1, 2, 3]
+
+
+def test_values_expire(store):
+    store.set("short", "gone soon", ttl=0.05)
+    store.set("long", "still here", ttl=60)
+    time.sleep(0.1)
+    assert store.get_many(["short", "long"]) == {"long": "still here"}
+
+
+def test_append_keeps_newest_items(store):
+    store.append("turns", [1, 2], max_length=3, ttl=60)
+    store.append("turns", [3, 4], max_length=3, ttl=60)
+    assert store.get_list("turns") == [2, 3, 4]
+    assert store.get_lists(["turns", "missing"]) == {"turns": [2, 3, 4]}
+    store.delete("turns")
+    assert store.get_list("turns") == []
+
+
+def test_appended_lists_expire(store):
+    store.append("turns", [{"turn": 1}], max_length=10, ttl=0.05)
+    time.sleep(0.1)
+    assert store.get_list("turns") == []
+    store.append("turns", [{"turn": 2}], max_length=10, ttl=60)
+    assert store.get_list("turns") == [{"turn": 2}]
+
+
+def test_concurrent_appends_are_all_kept(store):
+    def append_turns(writer):
+        for turn in range(20):
+            store.append("session", [{"writer": writer, "turn": turn}], max_length=1000, ttl=60)
+
+    threads = [threading.Thread(target=append_turns, args=(writer,)) for writer in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    items = store.get_list("session")
+    assert len(items) == 120
+    for writer in range(6):
+        assert [item["turn"] for item in items if item["writer"] == writer] == list(range(20))
+
+
+def test_redis_errors_surface_as_state_store_errors(resp_server):
+    store = RedisStateStore(f"redis://127.0.0.1:{resp_server.server_address[1]}/0")
+    store.append("list", ["item"], max_length=5)
+    with pytest.raises(StateStoreError):
+        store._execute([("GET", "list")])
+    with pytest.raises(StateStoreError):
+        store._execute([("NOSUCHCOMMAND",)])
+    # The connection stays usable after an error reply
+    store.set("plain", "value")
+    assert store.get("plain") == "value"
+    store.close()
+
+
+def test_redis_appends_are_not_resent_after_a_lost_reply(resp_server, monkeypatch):
+    store = RedisStateStore(f"redis://127.0.0.1:{resp_server.server_address[1]}/0")
+    store.delete("turns")
+    store.append("turns", [1], max_length=10)
+    # A connection the server closed while idle is replaced before the next append
+    store._execute([("QUIT",)])
+    deadline = time.monotonic() + 2
+    while not store._stale() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    store.append("turns", [2], max_length=10)
+
+    failures = []
+    read_reply = store._read_reply
+
+    def flaky_read_reply():
+        if failures:
+            raise failures.pop()
+        return read_reply()
+
+    monkeypatch.setattr(store, "_read_reply", flaky_read_reply)
+    # The server ran RPUSH but the reply was lost: surface it, don't push again
+    failures.append(ConnectionResetError("Connection reset by peer"))
+    with pytest.raises(OSError):
+        store.append("turns", [3], max_length=10)
+    # Reads are safe to resend
+    failures.append(ConnectionResetError("Connection reset by peer"))
+    assert store.get_list("turns") == [1, 2, 3]
+    store.close()
+
+
+def test_state_store_is_abstract():
+    from state_store import StateStore
+
+    class Partial(StateStore):
+        def get_many(self, keys):
+            return {}
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+class BrokenStore(InMemoryStateStore):
+    def get_many(self, keys):
+        raise ConnectionRefusedError("state store is down")
+
+    def set_many(self, items, ttl=None):
+        raise StateStoreError("READONLY You can't write against a read only replica")
+
+
+def test_shared_cache_falls_back_to_local_lru_when_store_fails():
+    import telemetry
+
+    cache = SharedCache(BrokenStore(), "query_embedding", ttl=60)
+    failures = telemetry.STATE_STORE_ERRORS.labels("query_embedding.get")._value.get()
+    assert cache.get("unseen", "fallback") == "fallback"
+    assert telemetry.STATE_STORE_ERRORS.labels("query_embedding.get")._value.get() == failures + 1
+
+    cache.put("query", [0.5, 0.25])
+    assert cache.get("query") == [0.5, 0.25]
+
+
+def test_shared_cache_reads_entries_written_by_other_workers():
+    store = InMemoryStateStore()
+    writer = SharedCache(store, "query_embedding")
+    reader = SharedCache(store, "query_embedding")
+    writer.put(("model", "query"), [1.0, 2.0])
+    assert reader.get(("model", "query")) == [1.0, 2.0]
+    assert SharedCache(store, "other").get(("model", "query")) is None
@@ -0,0 +1,49 @@
+import os
+import time
+
+from tts_cache import TTSAudioCache, tts_cache_key
+
+
+def store(cache, key, size):
+    return b"".join(cache.stream_and_store(key, [b"x" * size]))
+
+
+def age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_workers_share_entries(tmp_path):
+    first = TTSAudioCache(str(tmp_path), max_bytes=10000)
+    second = TTSAudioCache(str(tmp_path), max_bytes=10000)
+    key = tts_cache_key("Namaste", "hi")
+    assert second.lookup(key) is None
+    store(first, key, 100)
+    assert second.lookup(key) == os.path.join(str(tmp_path), f"{key}.mp3")
+
+
+def test_size_cap_applies_to_the_whole_directory(tmp_path):
+    unbounded = TTSAudioCache(str(tmp_path), max_bytes=10 ** 9)
+    for index in range(3):
+        store(unbounded, f"old{index}", 300)
+        age(unbounded._path(f"old{index}"), 100 - index)
+    first = TTSAudioCache(str(tmp_path), max_bytes=1000, grace_seconds=30)
+    second = TTSAudioCache(str(tmp_path), max_bytes=1000, grace_seconds=30)
+
+    # Recency comes from the file, so a hit in one worker protects the entry everywhere
+    assert second.lookup("old0")
+    store(first, "new", 300)
+    assert first.stats()["bytes"] == 900
+    assert second.lookup("old1") is None
+    assert second.lookup("old0") and second.lookup("old2") and second.lookup("new")
+
+
+def test_recently_used_entries_are_not_evicted(tmp_path):
+    cache = TTSAudioCache(str(tmp_path), max_bytes=500, grace_seconds=30)
+    store(cache, "playing", 400)
+    store(cache, "next", 400)
+    # Both were used within the grace period, so neither is deleted yet
+    assert cache.lookup("playing") and cache.lookup("next")
+    age(cache._path("playing"), 60)
+    store(cache, "third", 10)
+    assert cache.lookup("playing") is None
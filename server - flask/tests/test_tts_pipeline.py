@@ -0,0 +1,30 @@
+from tts_pipeline import split_sentences
+
+
+def test_abbreviations_and_list_markers_stay_with_their_sentence():
+    text = "Rs. 5000 per acre. 1. Carbon credits are paid yearly. 2. Dr. Rao explains e.g. paddy methane."
+    assert split_sentences(text) == [
+        "Rs. 5000 per acre.",
+        "1. Carbon credits are paid yearly.",
+        "2. Dr. Rao explains e.g. paddy methane.",
+    ]
+
+
+def test_short_segments_join_the_next_sentence():
+    assert split_sentences("Yes. Alternate wetting and drying saves water.") == [
+        "Yes. Alternate wetting and drying saves water.",
+    ]
+    # Nothing follows, so a short final segment is kept on its own
+    assert split_sentences("Alternate wetting and drying saves water. Thanks.") == [
+        "Alternate wetting and drying saves water.",
+        "Thanks.",
+    ]
+
+
+def test_indic_sentences_and_stray_punctuation():
+    text = "धान की खेती में पानी बचाएं।मीथेन उत्सर्जन कम होता है। 🙏\nNABARD ऋण उपलब्ध है!"
+    assert split_sentences(text) == [
+        "धान की खेती में पानी बचाएं।",
+        "मीथेन उत्सर्जन कम होता है। 🙏",
+        "NABARD ऋण उपलब्ध है!",
+    ]
@@ -0,0 +1,78 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pytest
+
+from vector_index import FCNTL_AVAILABLE, MappedIndexStore
+
+
+def build(store, version, texts=("alpha", "beta")):
+    vectors = lambda texts: np.eye(len(texts), 4, dtype=np.float32)
+    return store.load_or_build(version, list(texts), ["doc.md"] * len(texts), vectors)
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_versions_leased_by_a_live_worker_survive_a_sweep(tmp_path):
+    serving, sweeping = MappedIndexStore(str(tmp_path)), MappedIndexStore(str(tmp_path))
+    build(serving, "v1")
+    assert sweeping.sweep() == []
+    assert serving.exists("v1")
+    assert serving.load("v1").text(0) == "alpha"
+
+
+def test_released_versions_are_removed(tmp_path):
+    store = MappedIndexStore(str(tmp_path))
+    build(store, "v1")
+    assert store.release("v1") == ["v1"]
+    assert store.versions() == [] and store.load("v1") is None
+
+
+@pytest.mark.skipif(os.name != "posix", reason="liveness by pid is posix only")
+def test_leases_of_dead_workers_are_dropped_with_their_versions(tmp_path):
+    store = MappedIndexStore(str(tmp_path))
+    build(store, "v1")
+    os.remove(store._lease("v1"))
+    lease = tmp_path / f"v1.lease.{socket.gethostname()}.{dead_pid()}.deadbeef"
+    lease.touch()
+    assert store.sweep() == ["v1"]
+    assert not lease.exists() and not store.exists("v1")
+
+
+def test_leases_from_other_hosts_expire_by_age(tmp_path):
+    store = MappedIndexStore(str(tmp_path), lease_seconds=60)
+    build(store, "v1")
+    os.remove(store._lease("v1"))
+    lease = tmp_path / "v1.lease.other-host.4242.deadbeef"
+    lease.touch()
+    assert store.sweep() == [] and store.exists("v1")
+    stale = time.time() - 120
+    os.utime(lease, (stale, stale))
+    assert store.sweep() == ["v1"]
+
+
+@pytest.mark.skipif(not FCNTL_AVAILABLE, reason="needs flock")
+def test_sweep_skips_while_a_worker_is_loading(tmp_path):
+    loading, sweeping = MappedIndexStore(str(tmp_path)), MappedIndexStore(str(tmp_path))
+    build(sweeping, "v1")
+    os.remove(sweeping._lease("v1"))
+    with loading._lock(".sweep.lock", shared=True):
+        assert sweeping.sweep() == []
+    assert sweeping.exists("v1")
+    assert sweeping.sweep() == ["v1"]
+
+
+def test_published_version_round_trips(tmp_path):
+    store = MappedIndexStore(str(tmp_path))
+    assert store.active() is None
+    store.publish("v1", "v2")
+    assert MappedIndexStore(str(tmp_path)).active() == {"version": "v1", "built_from": "v2"}
+    assert store.versions() == []
@@ -0,0 +1,141 @@
+import hashlib
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# Older .part files belong to writes interrupted by a crash or restart
+STALE_PART_SECONDS = 3600
+
+
+def normalize_tts_text(text: str) -> str:
+    """Normalise text so equivalent messages share one cache entry"""
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def tts_cache_key(text: str, lang: str, slow: bool = False) -> str:
+    """Content address for synthesised audio"""
+    payload = f"{lang}\x00{'slow' if slow else 'normal'}\x00{normalize_tts_text(text)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSAudioCache:
+    """Disk-backed, size-capped LRU cache of synthesised MP3 audio.
+
+    Entries are stored as ``<key>.mp3`` files named by their content address,
+    so hits can be served straight from disk and the key doubles as an ETag.
+    The directory itself is the index: every worker sees entries written by
+    the others, recency is the file mtime (refreshed on every hit), and
+    ``max_bytes`` caps the directory as a whole. Files used in the last
+    ``grace_seconds`` are never evicted, so no worker deletes audio that
+    another is still sending.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, grace_seconds: float = 60.0):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._remove_stale_parts()
+        self._evict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def _remove_stale_parts(self):
+        cutoff = time.time() - STALE_PART_SECONDS
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".part"):
+                try:
+                    if entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def _scan(self) -> List[Tuple[float, int, str]]:
+        """``(mtime, size, path)`` of every entry, whichever worker wrote it"""
+        found = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".mp3"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            found.append((stat.st_mtime, stat.st_size, entry.path))
+        return found
+
+    def lookup(self, key: str) -> Optional[str]:
+        """Return the file path for a cached entry and mark it recently used"""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            # Never cached, or evicted by this or another worker
+            return None
+        return path
+
+    def stream_and_store(self, key: str, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """Yield audio chunks to the caller while writing them to the cache.
+
+        The entry is only published once every chunk has been written, so a
+        failed synthesis or a client disconnect never leaves truncated audio
+        behind.
+        """
+        part_path = f"{self._path(key)}.{uuid.uuid4().hex}.part"
+        size = 0
+        completed = False
+        try:
+            with open(part_path, "wb") as part:
+                for chunk in chunks:
+                    if not chunk:
+                        continue
+                    part.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            completed = size > 0
+        finally:
+            if completed:
+                self._commit(key, part_path, size)
+            else:
+                try:
+                    os.remove(part_path)
+                except OSError:
+                    pass
+
+    def _commit(self, key: str, part_path: str, size: int):
+        os.replace(part_path, self._path(key))
+        self._evict()
+
+    def _evict(self):
+        """Delete least recently used entries until the directory fits ``max_bytes``"""
+        with self._lock:
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            cutoff = time.time() - self.grace_seconds
+            for modified, size, path in sorted(entries):
+                if total <= self.max_bytes or modified >= cutoff:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+    def stats(self) -> dict:
+        entries = self._scan()
+        return {
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+
+def default_tts_cache_dir() -> str:
+    return os.path.join(tempfile.gettempdir(), "kisaancredit_tts_cache")
@@ -0,0 +1,108 @@
+import contextvars
+import importlib
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterator, List
+
+from gtts import gTTS
+
+import telemetry
+
+# Danda/double danda end sentences in most Indic scripts, often without a following space
+SENTENCE_BOUNDARY = re.compile(r"(?<=[।॥])\s*|(?<=[.!?۔])\s+|\n+")
+WORD_CHARACTER = re.compile(r"\w")
+# A full stop after these does not end the sentence ("Rs. 5000", "Dr. Rao", "e.g. paddy")
+ABBREVIATION = re.compile(
+    r"(?:^|[\s(])(?:rs|dr|mr|mrs|ms|smt|shri|sh|st|no|nos|vs|viz|approx|govt|dept|prof|"
+    r"e\.g|i\.e|sq|ft|km|kg|qtl|ha|pvt|ltd)\.$",
+    re.IGNORECASE,
+)
+# Shorter segments (list markers like "1.", "Yes.") are read together with what follows
+MIN_SEGMENT_CHARS = 12
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split a reply into sentence-sized segments for synthesis"""
+    segments = []
+    pending = ""
+    for part in SENTENCE_BOUNDARY.split(text):
+        part = part.strip()
+        if not part:
+            continue
+        if not WORD_CHARACTER.search(part):
+            # Stray punctuation or emoji has nothing to pronounce on its own
+            if segments and not pending:
+                segments[-1] = f"{segments[-1]} {part}"
+            else:
+                pending = f"{pending} {part}".strip()
+            continue
+        part = f"{pending} {part}" if pending else part
+        if len(part) < MIN_SEGMENT_CHARS or ABBREVIATION.search(part):
+            pending = part
+            continue
+        segments.append(part)
+        pending = ""
+    if pending:
+        segments.append(pending)
+    return segments
+
+
+class GTTSBackend:
+    """Google Translate TTS"""
+
+    def synthesize(self, text: str, lang: str, slow: bool = False) -> bytes:
+        return b"".join(gTTS(text=text, lang=lang, slow=slow).stream())
+
+
+TTS_BACKENDS = {
+    "gtts": GTTSBackend,
+}
+
+
+def create_tts_backend(name: str = "gtts"):
+    """Build a TTS backend by registry name or ``module:ClassName`` path"""
+    if name in TTS_BACKENDS:
+        return TTS_BACKENDS[name]()
+    module_name, _, class_name = name.partition(":")
+    if not class_name:
+        raise ValueError(f"Unknown TTS backend: {name}")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+class TTSPipeline:
+    """Synthesise sentences concurrently and stream them back in order.
+
+    The worker pool is shared by every request, which bounds the number of
+    concurrent upstream TTS calls; each request keeps at most
+    ``max_in_flight`` segments queued so long replies cannot starve others.
+    """
+
+    def __init__(self, backend, max_workers: int = 4, max_in_flight: int = 3):
+        self.backend = backend
+        self.max_in_flight = max(1, max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="tts")
+
+    def stream(self, text: str, lang: str, slow: bool = False) -> Iterator[bytes]:
+        segments = iter(split_sentences(text))
+        pending = deque(self._submit(segment, lang, slow) for segment in islice(segments, self.max_in_flight))
+        try:
+            while pending:
+                audio = pending.popleft().result()
+                # Refill the window before handing audio to the (possibly slow) client
+                for segment in islice(segments, 1):
+                    pending.append(self._submit(segment, lang, slow))
+                if audio:
+                    yield audio
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _submit(self, segment: str, lang: str, slow: bool):
+        # Carry the request's trace context into the worker thread
+        return self._executor.submit(contextvars.copy_context().run, self._synthesize, segment, lang, slow)
+
+    def _synthesize(self, segment: str, lang: str, slow: bool) -> bytes:
+        with telemetry.span("tts.segment", chars=len(segment)):
+            return self.backend.synthesize(segment, lang, slow)
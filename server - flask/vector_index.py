@@ -0,0 +1,283 @@
+import hashlib
+import json
+import logging
+import os
+import socket
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    # Windows: no cross-process lock, workers may race to build but the atomic
+    # renames below still leave one complete copy of each version
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+
+def index_version(texts: List[str], model: str = "") -> str:
+    """Stable id for an index built from these chunks with this embedding model"""
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for text in texts:
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()[:16]
+
+
+class MappedVectorIndex:
+    """Read-only chunk store and embedding matrix backed by memory-mapped files.
+
+    Each version is a set of files: the UTF-8 chunk texts back to back, their
+    byte offsets, per-chunk source ids, the L2-normalised float32 embedding
+    matrix, and a small JSON manifest written last as the commit marker. Every
+    worker maps the same files, so the OS page cache holds one copy no matter
+    how many workers run.
+    """
+
+    def __init__(self, directory: str, version: str):
+        self.directory = directory
+        self.version = version
+        prefix = os.path.join(directory, version)
+        with open(f"{prefix}.json", encoding="utf-8") as handle:
+            manifest = json.load(handle)
+        self.sources = manifest["sources"]
+        self.source_ids = np.load(f"{prefix}.sources.npy", mmap_mode="r")
+        self.offsets = np.load(f"{prefix}.offsets.npy", mmap_mode="r")
+        self.matrix = np.load(f"{prefix}.vectors.npy", mmap_mode="r")
+        self._texts = np.memmap(f"{prefix}.texts.bin", dtype=np.uint8, mode="r")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def text(self, chunk_id: int) -> str:
+        start, end = int(self.offsets[chunk_id]), int(self.offsets[chunk_id + 1])
+        return bytes(self._texts[start:end]).decode("utf-8")
+
+    def texts(self) -> Iterator[str]:
+        for chunk_id in range(len(self)):
+            yield self.text(chunk_id)
+
+    def document(self, chunk_id: int) -> Document:
+        return Document(
+            page_content=self.text(chunk_id),
+            metadata={"source": self.sources[int(self.source_ids[chunk_id])], "chunk_id": chunk_id},
+        )
+
+    def search(self, vector: List[float], k: int) -> List[int]:
+        """Chunk ids by cosine similarity, best first"""
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+        scores = self.matrix @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [int(chunk_id) for chunk_id in top[np.argsort(-scores[top])]]
+
+
+class MappedIndexStore:
+    """Directory of index versions shared by every worker on the host.
+
+    Workers hold a lease file per version they serve or keep for rollback,
+    and ``sweep`` only deletes versions nobody holds. A lease is live while
+    its process runs (same host) or was renewed within ``lease_seconds``.
+    ``publish`` records which version every worker should serve, so a reload
+    or rollback on one worker reaches the others.
+    """
+
+    def __init__(self, directory: str, lease_seconds: float = 24 * 3600):
+        self.directory = directory
+        self.lease_seconds = lease_seconds
+        # host.pid.token: one lease per store instance, checkable for liveness by pid
+        self._owner = f"{socket.gethostname()}.{os.getpid()}.{uuid.uuid4().hex[:8]}"
+        os.makedirs(directory, exist_ok=True)
+
+    def _manifest(self, version: str) -> str:
+        return os.path.join(self.directory, f"{version}.json")
+
+    def exists(self, version: str) -> bool:
+        return os.path.exists(self._manifest(version))
+
+    @contextmanager
+    def _lock(self, name: str, shared: bool = False, blocking: bool = True):
+        """flock on a lock file; yields False if ``blocking`` is off and it is taken"""
+        if not FCNTL_AVAILABLE:
+            yield True
+            return
+        with open(os.path.join(self.directory, name), "w") as handle:
+            mode = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+            try:
+                fcntl.flock(handle, mode if blocking else mode | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def load_or_build(self, version: str, texts: List[str], sources: List[str],
+                      embed: Callable[[List[str]], np.ndarray]) -> MappedVectorIndex:
+        """Lease and map an existing version, or embed and write it if no worker has yet.
+
+        ``texts`` must be non-empty; ``embed`` returns one row per text.
+        """
+        # Leased before looking, so no sweep that starts from here on can remove it
+        self.acquire(version)
+        with self._lock(".sweep.lock", shared=True):
+            if not self.exists(version):
+                waited = time.perf_counter()
+                with self._lock(".build.lock"):
+                    if self.exists(version):
+                        logger.info("Index %s built by another worker after %.2fs", version, time.perf_counter() - waited)
+                    else:
+                        self._write(version, texts, sources, embed(texts))
+            return MappedVectorIndex(self.directory, version)
+
+    def load(self, version: str) -> Optional[MappedVectorIndex]:
+        """Lease and map a version another worker wrote; None if it no longer exists"""
+        self.acquire(version)
+        with self._lock(".sweep.lock", shared=True):
+            if self.exists(version):
+                return MappedVectorIndex(self.directory, version)
+        self.release(version)
+        return None
+
+    def publish(self, version: str, built_from: str):
+        """Make ``version`` the one to serve while the documents hash to ``built_from``"""
+        path = os.path.join(self.directory, ".active")
+        temporary = f"{path}.{self._owner}.tmp"
+        with open(temporary, "w") as handle:
+            json.dump({"version": version, "built_from": built_from}, handle)
+        os.replace(temporary, path)
+
+    def active(self) -> Optional[dict]:
+        """The last published ``{"version", "built_from"}``, if any"""
+        try:
+            with open(os.path.join(self.directory, ".active")) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, version: str, texts: List[str], sources: List[str], vectors: np.ndarray):
+        prefix = os.path.join(self.directory, version)
+        source_names = sorted(set(sources))
+        source_index = {name: position for position, name in enumerate(source_names)}
+
+        encoded = [text.encode("utf-8") for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(chunk) for chunk in encoded], out=offsets[1:])
+
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = matrix / np.where(norms == 0, 1, norms)
+
+        def replace(suffix, write):
+            temporary = f"{prefix}{suffix}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as handle:
+                write(handle)
+            os.replace(temporary, f"{prefix}{suffix}")
+
+        replace(".texts.bin", lambda handle: handle.write(b"".join(encoded)))
+        replace(".offsets.npy", lambda handle: np.save(handle, offsets))
+        replace(".sources.npy", lambda handle: np.save(handle, np.array(
+            [source_index[source] for source in sources], dtype=np.int32)))
+        replace(".vectors.npy", lambda handle: np.save(handle, matrix))
+        # The manifest is the commit marker: readers only trust versions that have one
+        replace(".json", lambda handle: handle.write(json.dumps({
+            "version": version,
+            "count": len(texts),
+            "dimensions": int(matrix.shape[1]),
+            "text_bytes": int(offsets[-1]),
+            "sources": source_names,
+        }).encode("utf-8")))
+
+    def remove(self, version: str):
+        """Delete a version outright; ``sweep`` is the safe way when workers share the store"""
+        for suffix in (".json", ".texts.bin", ".offsets.npy", ".sources.npy", ".vectors.npy"):
+            try:
+                os.remove(os.path.join(self.directory, f"{version}{suffix}"))
+            except OSError:
+                pass
+
+    def _lease(self, version: str) -> str:
+        return os.path.join(self.directory, f"{version}.lease.{self._owner}")
+
+    def acquire(self, version: str):
+        """Record that this worker uses ``version``"""
+        with open(self._lease(version), "a"):
+            pass
+        os.utime(self._lease(version))
+
+    def renew(self, versions: Iterable[str]):
+        for version in versions:
+            try:
+                os.utime(self._lease(version))
+            except FileNotFoundError:
+                self.acquire(version)
+
+    def release(self, version: str) -> List[str]:
+        """Drop this worker's lease, then sweep; returns the versions removed"""
+        try:
+            os.remove(self._lease(version))
+        except OSError:
+            pass
+        return self.sweep()
+
+    def _lease_alive(self, owner: str, modified: float) -> bool:
+        host, pid, _ = owner.rsplit(".", 2) if owner.count(".") >= 2 else ("", "", "")
+        if os.name == "posix" and host == socket.gethostname() and pid.isdigit():
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return False
+            except PermissionError:
+                pass
+            return True
+        return time.time() - modified < self.lease_seconds
+
+    def sweep(self) -> List[str]:
+        """Remove versions no live worker holds a lease on, and leases of dead workers"""
+        with self._lock(".sweep.lock", blocking=False) as locked:
+            if not locked:
+                # A worker is loading or building; the next sweep gets it
+                return []
+            live = defaultdict(int)
+            for name in os.listdir(self.directory):
+                version, marker, owner = name.partition(".lease.")
+                if not marker:
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    modified = os.stat(path).st_mtime
+                except OSError:
+                    continue
+                if self._lease_alive(owner, modified):
+                    live[version] += 1
+                else:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            removed = [version for version in self.versions() if not live[version]]
+            for version in removed:
+                self.remove(version)
+            if removed:
+                logger.info("Removed unused index versions: %s", ", ".join(removed))
+            return removed
+
+    def versions(self) -> List[str]:
+        return sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith(".json"))
+
+
+def default_index_dir() -> str:
+    return os.path.join(tempfile.gettempdir(), "kisaancredit_index")